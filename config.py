@@ -1,6 +1,20 @@
 from dotenv import load_dotenv
 import os
 from decouple import config
+from typing import Dict
+
+def _parse_provider_timeouts(value: str) -> Dict[str, float]:
+    """Parse "provider:seconds" entries separated by whitespace, e.g. "claude:45 qwen:20" """
+    timeouts = {}
+    for entry in value.split():
+        provider, _, seconds = entry.partition(":")
+        try:
+            timeouts[provider] = float(seconds)
+        except ValueError:
+            raise ValueError(f"Invalid LLM_PROVIDER_TIMEOUTS entry {entry!r}, expected provider:seconds")
+        if not provider or timeouts[provider] <= 0:
+            raise ValueError(f"Invalid LLM_PROVIDER_TIMEOUTS entry {entry!r}, expected provider:seconds")
+    return timeouts
 
 # Load .env file
 load_dotenv()
@@ -32,6 +46,26 @@ GOOGLE_API_KEY = config("GOOGLE_API_KEY", default="")
 DEEPSEEK_API_KEY = config("DEEPSEEK_API_KEY", default="")
 QWEN_API_KEY = config("QWEN_API_KEY", default="")
 
+# LLM Connection Configuration
+LLM_MAX_CONNECTIONS = config("LLM_MAX_CONNECTIONS", default=20, cast=int)  # per provider
+LLM_KEEPALIVE_CONNECTIONS = config("LLM_KEEPALIVE_CONNECTIONS", default=10, cast=int)  # per provider
+LLM_KEEPALIVE_EXPIRY = config("LLM_KEEPALIVE_EXPIRY", default=60.0, cast=float)  # seconds
+LLM_TIMEOUT = config("LLM_TIMEOUT", default=30.0, cast=float)  # seconds
+# provider -> seconds, from entries like "claude:45 qwen:20"
+LLM_PROVIDER_TIMEOUTS = _parse_provider_timeouts(config("LLM_PROVIDER_TIMEOUTS", default=""))
+
+# LLM Routing Configuration
+LLM_LATENCY_WINDOW = config("LLM_LATENCY_WINDOW", default=100, cast=int)  # recent calls tracked per provider
+LLM_CIRCUIT_FAILURES = config("LLM_CIRCUIT_FAILURES", default=3, cast=int)  # consecutive failures that open a circuit
+LLM_CIRCUIT_COOLDOWN = config("LLM_CIRCUIT_COOLDOWN", default=60.0, cast=float)  # seconds a circuit stays open
+LLM_HEDGING = config("LLM_HEDGING", default=False, cast=bool)  # also ask a second provider when the first is slow
+LLM_HEDGE_AFTER = config("LLM_HEDGE_AFTER", default=5.0, cast=float)  # seconds, until a provider's p95 is known
+
+# LLM Prompt Configuration
+LLM_PROMPT_BUDGET = config("LLM_PROMPT_BUDGET", default=3000, cast=int)  # max prompt tokens of a casual reply
+STYLE_PROMPT_BUDGET = config("STYLE_PROMPT_BUDGET", default=8000, cast=int)  # max prompt tokens of a style analysis
+PROMPT_MESSAGE_MAX_TOKENS = config("PROMPT_MESSAGE_MAX_TOKENS", default=300, cast=int)  # longer chat messages are cut
+
 # News API Configuration
 NEWS_API_KEY = config("NEWS_API_KEY", default="")
 NEWSDATA_API_KEY = config("NEWSDATA_API_KEY", default="")
@@ -50,12 +84,62 @@ TWITTER_API_SECRET = config("TWITTER_API_SECRET", default="")
 # Rate Limiting Configuration
 RATE_LIMIT_REQUESTS = config("RATE_LIMIT_REQUESTS", default=3, cast=int)
 RATE_LIMIT_WINDOW = config("RATE_LIMIT_WINDOW", default=86400, cast=int)  # 24 hours
+RATE_LIMIT_FLUSH_INTERVAL = config("RATE_LIMIT_FLUSH_INTERVAL", default=5, cast=int)  # seconds between writes to MongoDB
 
 # Bot Features Configuration
 CHAT_HISTORY_DAYS = config("CHAT_HISTORY_DAYS", default=20, cast=int)
 MAX_INTERACTION_MESSAGES = config("MAX_INTERACTION_MESSAGES", default=20, cast=int)
 MAX_RESULTS_NON_ADMIN = config("MAX_RESULTS_NON_ADMIN", default=10, cast=int)
 MAX_TWEETS_RESULTS = config("MAX_TWEETS_RESULTS", default=5, cast=int)
+CHAT_HISTORY_BATCH_SIZE = config("CHAT_HISTORY_BATCH_SIZE", default=500, cast=int)
+CHAT_HISTORY_FLUSH_INTERVAL = config("CHAT_HISTORY_FLUSH_INTERVAL", default=1.0, cast=float)  # seconds
+CHAT_HISTORY_MAX_PENDING = config("CHAT_HISTORY_MAX_PENDING", default=10000, cast=int)
+RECENT_CONTEXT_MESSAGES = config("RECENT_CONTEXT_MESSAGES", default=20, cast=int)  # kept in memory per chat for casual replies
+CASUAL_STREAMING = config("CASUAL_STREAMING", default=True, cast=bool)  # show casual replies as they are generated
+STREAM_EDIT_INTERVAL = config("STREAM_EDIT_INTERVAL", default=1.5, cast=float)  # min seconds between edits of a streamed reply
+STYLE_REFRESH_MESSAGES = config("STYLE_REFRESH_MESSAGES", default=200, cast=int)  # new messages that trigger a style refresh
+STYLE_REFRESH_MIN_MESSAGES = config("STYLE_REFRESH_MIN_MESSAGES", default=20, cast=int)  # fewer new messages never refresh
+STYLE_REFRESH_INTERVAL = config("STYLE_REFRESH_INTERVAL", default=21600, cast=int)  # seconds before a profile is refreshed anyway
+# Store chat_history as one document per chat per "hour" or "day"; empty keeps one document per message
+CHAT_HISTORY_BUCKETS = config("CHAT_HISTORY_BUCKETS", default="")
+# Messages per bucket document before a busy chat's hour or day rolls over to another; keeps it far below 16MB
+CHAT_HISTORY_BUCKET_SIZE = config("CHAT_HISTORY_BUCKET_SIZE", default=1000, cast=int)
+STATS_FLUSH_INTERVAL = config("STATS_FLUSH_INTERVAL", default=30, cast=int)  # seconds between counter writes
+STATS_CACHE_TTL = config("STATS_CACHE_TTL", default=60, cast=int)  # seconds /stats reuses a summary
+USER_CACHE_SIZE = config("USER_CACHE_SIZE", default=10000, cast=int)
+USER_CACHE_TTL = config("USER_CACHE_TTL", default=300, cast=int)  # seconds a cached user profile is trusted
+SEARCH_RESULT_PREVIEW_CHARS = config("SEARCH_RESULT_PREVIEW_CHARS", default=200, cast=int)  # stored characters of each text or description
+SEARCH_RESULTS_COMPRESS = config("SEARCH_RESULTS_COMPRESS", default=False, cast=bool)
+SEARCH_RESULTS_FLUSH_INTERVAL = config("SEARCH_RESULTS_FLUSH_INTERVAL", default=5.0, cast=float)  # seconds
+
+# Retention Configuration (enforced by MongoDB TTL indexes, 0 keeps documents forever)
+RATE_LIMITS_RETENTION_HOURS = config("RATE_LIMITS_RETENTION_HOURS", default=24, cast=int)
+CHAT_HISTORY_RETENTION_DAYS = config("CHAT_HISTORY_RETENTION_DAYS", default=30, cast=int)
+SEARCH_RESULTS_RETENTION_DAYS = config("SEARCH_RESULTS_RETENTION_DAYS", default=30, cast=int)
+
+# Scanner Configuration
+SCANNER_CONCURRENCY = config("SCANNER_CONCURRENCY", default=8, cast=int)  # Parallel chat scans per session
+SCANNER_FLOOD_RETRIES = config("SCANNER_FLOOD_RETRIES", default=3, cast=int)
+SCANNER_MAX_FLOOD_WAIT = config("SCANNER_MAX_FLOOD_WAIT", default=300, cast=int)  # seconds
+SCANNER_FLOOD_WINDOW = config("SCANNER_FLOOD_WINDOW", default=600, cast=int)  # seconds of FloodWait history used for balancing
+# Pyrogram session names of the user accounts used for scanning; the first one is the primary
+SCANNER_SESSIONS = config("SCANNER_SESSIONS", default="scanner_session").split()
+MESSAGE_INDEX_ENABLED = config("MESSAGE_INDEX_ENABLED", default=True, cast=bool)
+MESSAGE_INDEX_PATH = config("MESSAGE_INDEX_PATH", default="data/message_index.db")
+SCANNER_SERVER_SEARCH = config("SCANNER_SERVER_SEARCH", default=False, cast=bool)  # Use Telegram search for plain terms
+SCANNER_GLOBAL_SEARCH = config("SCANNER_GLOBAL_SEARCH", default=False, cast=bool)  # Use Telegram global search in /searchall
+SCANNER_GLOBAL_SEARCH_LIMIT = config("SCANNER_GLOBAL_SEARCH_LIMIT", default=1000, cast=int)  # Hits per term
+SCAN_CHECKPOINTS_ENABLED = config("SCAN_CHECKPOINTS_ENABLED", default=True, cast=bool)
+SCAN_CHECKPOINT_PATH = config("SCAN_CHECKPOINT_PATH", default="data/scan_checkpoints.db")
+SCAN_CHECKPOINT_TTL = config("SCAN_CHECKPOINT_TTL", default=3600, cast=int)  # seconds a scanned chat of an unfinished job stays reusable
+DIALOG_CACHE_TTL = config("DIALOG_CACHE_TTL", default=300, cast=int)  # seconds
+# Chat types the global search is trusted to cover; other dialogs are still scanned one by one
+SCANNER_GLOBAL_SEARCH_TYPES = config("SCANNER_GLOBAL_SEARCH_TYPES", default="private bot group supergroup channel").split()
+
+# Export Configuration
+EXPORT_FORMAT = config("EXPORT_FORMAT", default="txt")  # txt, jsonl or csv
+EXPORT_GZIP_THRESHOLD = config("EXPORT_GZIP_THRESHOLD", default=5 * 1024 * 1024, cast=int)  # bytes
+DOCUMENT_SPOOL_THRESHOLD = config("DOCUMENT_SPOOL_THRESHOLD", default=20 * 1024 * 1024, cast=int)  # bytes uploaded from memory
 
 # File Configuration
 DOWNLOADS_PATH = config("DOWNLOADS_PATH", default="downloads/")
@@ -0,0 +1,110 @@
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Tuple
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from database.write_buffer import WriteBuffer
+
+BUCKET_GRANULARITIES = ("hour", "day")
+
+def bucket_start(timestamp: datetime, granularity: str) -> datetime:
+    """Get the start of the hour or day bucket a timestamp falls in"""
+    if granularity == "day":
+        return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+def compact_message(message: Dict, keep_id: bool = False) -> Dict:
+    """Shrink a chat_history document to the short-keyed form stored inside a bucket
+
+    With keep_id, the source document's _id is kept as "id" so a migration can tell
+    which messages it already moved.
+    """
+    compacted = {
+        "u": message["user_id"],
+        "n": message.get("username"),
+        "t": message["message_text"],
+        "ts": message["timestamp"]
+    }
+    if keep_id:
+        compacted["id"] = message["_id"]
+    return compacted
+
+def expand_bucket(bucket: Dict) -> List[Dict]:
+    """Turn a bucket back into chat_history style documents, oldest first"""
+    return [
+        {
+            "chat_id": bucket["chat_id"],
+            "user_id": message["u"],
+            "username": message.get("n"),
+            "message_text": message["t"],
+            "timestamp": message["ts"]
+        }
+        for message in bucket.get("messages", [])
+    ]
+
+def bucket_updates(
+    messages: List[Dict],
+    granularity: str,
+    max_messages: int,
+    keep_ids: bool = False
+) -> Tuple[List[UpdateOne], List[int]]:
+    """Build upserts appending messages to their (chat, bucket), and each upsert's message count
+
+    Only a document of the bucket holding fewer than max_messages is appended to; once all
+    are full the upsert starts a new one. Each upsert adds at most max_messages, so no
+    document grows past twice that.
+    """
+    grouped = OrderedDict()
+    for message in messages:
+        key = (message["chat_id"], bucket_start(message["timestamp"], granularity))
+        grouped.setdefault(key, []).append(compact_message(message, keep_ids))
+
+    updates = []
+    sizes = []
+    for (chat_id, bucket), compacted in grouped.items():
+        for start in range(0, len(compacted), max_messages):
+            chunk = compacted[start:start + max_messages]
+            updates.append(UpdateOne(
+                {"chat_id": chat_id, "bucket": bucket, "count": {"$lt": max_messages}},
+                {
+                    "$push": {"messages": {"$each": chunk}},
+                    "$inc": {"count": len(chunk)},
+                    # Newest message time, so the TTL index only expires a bucket once all of it is old
+                    "$max": {"timestamp": chunk[-1]["ts"]}
+                },
+                upsert=True
+            ))
+            sizes.append(len(chunk))
+    return updates, sizes
+
+async def write_buckets(collection, messages: List[Dict], granularity: str, max_messages: int) -> int:
+    """Append messages to their buckets in one unordered bulk write, returning how many were stored"""
+    updates, sizes = bucket_updates(messages, granularity, max_messages)
+    if not updates:
+        return 0
+
+    try:
+        await collection.bulk_write(updates, ordered=False)
+        return len(messages)
+    except BulkWriteError as e:
+        failed = sum(sizes[error["index"]] for error in e.details.get("writeErrors", []))
+        print(f"Error writing {collection.name} batch: {failed} messages failed")
+        return len(messages) - failed
+
+class BucketWriteBuffer(WriteBuffer):
+    """Write buffer that appends chat messages to per-chat hour or day buckets"""
+    def __init__(
+        self,
+        collection,
+        granularity: str,
+        max_messages: int,
+        batch_size: int,
+        flush_interval: float,
+        max_pending: int
+    ):
+        super().__init__(collection, batch_size, flush_interval, max_pending)
+        self.granularity = granularity
+        self.max_messages = max_messages
+
+    async def _write(self, batch: List[Dict]) -> int:
+        return await write_buckets(self.collection, batch, self.granularity, self.max_messages)
@@ -1,12 +1,36 @@
+import time
 import motor.motor_asyncio
+from pymongo import ReturnDocument
+from collections import deque
 from typing import Dict, List, Optional
 from datetime import datetime, timedelta
-from config import DATABASE_URI, DATABASE_NAME
+from config import (
+    DATABASE_URI, DATABASE_NAME, RATE_LIMIT_WINDOW, RATE_LIMITS_RETENTION_HOURS,
+    CHAT_HISTORY_RETENTION_DAYS, SEARCH_RESULTS_RETENTION_DAYS,
+    CHAT_HISTORY_BATCH_SIZE, CHAT_HISTORY_FLUSH_INTERVAL, CHAT_HISTORY_MAX_PENDING,
+    RECENT_CONTEXT_MESSAGES, CHAT_HISTORY_BUCKETS, CHAT_HISTORY_BUCKET_SIZE, STATS_CACHE_TTL,
+    USER_CACHE_SIZE, USER_CACHE_TTL,
+    SEARCH_RESULT_PREVIEW_CHARS, SEARCH_RESULTS_COMPRESS, SEARCH_RESULTS_FLUSH_INTERVAL
+)
+from database.write_buffer import WriteBuffer
+from database.stats import activity_stats
+from database.lru_cache import LRUCache
+from database.search_history import pack_results, unpack_results
+from database.chat_buckets import BUCKET_GRANULARITIES, BucketWriteBuffer, bucket_start, bucket_updates, expand_bucket
+
+TTL_INDEX_NAME = "timestamp_ttl"
 
 class Database:
     def __init__(self):
         self.client = None
         self.db = None
+        self.chat_history_buffer = None
+        self.search_results_buffer = None
+        self.recent_messages = {}  # chat_id -> deque of the newest chat_history documents
+        self.warmed_chats = set()  # chats whose recent_messages were loaded from MongoDB
+        self._stats_summary = None
+        self._stats_summary_at = 0.0
+        self.user_cache = LRUCache(USER_CACHE_SIZE, USER_CACHE_TTL)  # user_id -> profile, or None if unknown
 
     async def connect(self):
         """Connect to MongoDB database"""
@@ -17,39 +41,141 @@ class Database:
         await self.db.users.create_index("user_id", unique=True)
         await self.db.rate_limits.create_index([("user_id", 1), ("command", 1)])
         await self.db.chat_history.create_index([("chat_id", 1), ("timestamp", 1)])
+        await self.db.search_results.create_index([("user_id", 1), ("search_type", 1), ("timestamp", -1)])
+        await self.db.chat_styles.create_index("chat_id", unique=True)
+        
+        # Retention: MongoDB deletes documents once their timestamp is older than these
+        await self._ensure_ttl_index(
+            self.db.rate_limits,
+            # Records must outlive the rate limit window they are counted in
+            max(RATE_LIMITS_RETENTION_HOURS * 3600, RATE_LIMIT_WINDOW) if RATE_LIMITS_RETENTION_HOURS else 0
+        )
+        await self._ensure_ttl_index(self.db.chat_history, CHAT_HISTORY_RETENTION_DAYS * 86400)
+        await self._ensure_ttl_index(self.db.search_results, SEARCH_RESULTS_RETENTION_DAYS * 86400)
+        
+        if CHAT_HISTORY_BUCKETS and CHAT_HISTORY_BUCKETS not in BUCKET_GRANULARITIES:
+            raise ValueError(f"CHAT_HISTORY_BUCKETS must be one of {', '.join(BUCKET_GRANULARITIES)}")
+        if CHAT_HISTORY_BUCKETS:
+            # One document per chat per hour or day instead of one per message; a busy chat's
+            # hour or day rolls over to more documents, so (chat_id, bucket) is no longer unique
+            indexes = await self.db.chat_history_buckets.index_information()
+            if indexes.get("chat_id_1_bucket_1", {}).get("unique"):
+                await self.db.chat_history_buckets.drop_index("chat_id_1_bucket_1")
+            await self.db.chat_history_buckets.create_index([("chat_id", 1), ("bucket", 1), ("count", 1)])
+            await self._ensure_ttl_index(self.db.chat_history_buckets, CHAT_HISTORY_RETENTION_DAYS * 86400)
+            self.chat_history_buffer = BucketWriteBuffer(
+                self.db.chat_history_buckets, CHAT_HISTORY_BUCKETS, CHAT_HISTORY_BUCKET_SIZE,
+                CHAT_HISTORY_BATCH_SIZE, CHAT_HISTORY_FLUSH_INTERVAL, CHAT_HISTORY_MAX_PENDING
+            )
+        else:
+            self.chat_history_buffer = WriteBuffer(
+                self.db.chat_history, CHAT_HISTORY_BATCH_SIZE,
+                CHAT_HISTORY_FLUSH_INTERVAL, CHAT_HISTORY_MAX_PENDING
+            )
+        self.chat_history_buffer.start()
+        # Search history is written off the reply path, a few searches per batch
+        self.search_results_buffer = WriteBuffer(
+            self.db.search_results, 100, SEARCH_RESULTS_FLUSH_INTERVAL, 1000
+        )
+        self.search_results_buffer.start()
+        activity_stats.start(self.db.stats)
+
+    async def _ensure_ttl_index(self, collection, seconds: int):
+        """Expire a collection's documents seconds after their timestamp, or never if seconds is 0"""
+        existing = (await collection.index_information()).get(TTL_INDEX_NAME)
         
+        if seconds <= 0:
+            if existing:
+                await collection.drop_index(TTL_INDEX_NAME)
+        elif not existing:
+            await collection.create_index("timestamp", name=TTL_INDEX_NAME, expireAfterSeconds=seconds)
+        elif existing.get("expireAfterSeconds") != seconds:
+            # Retention changed: update the index in place rather than rebuilding it
+            await self.db.command(
+                "collMod", collection.name,
+                index={"name": TTL_INDEX_NAME, "expireAfterSeconds": seconds}
+            )
+
     async def close(self):
         """Close database connection"""
+        if self.chat_history_buffer:
+            await self.chat_history_buffer.close()
+        if self.search_results_buffer:
+            await self.search_results_buffer.close()
+        await activity_stats.stop()
         if self.client:
             self.client.close()
 
+    async def get_storage_report(self) -> List[Dict]:
+        """Get document count, data size and index sizes of every collection, largest first"""
+        report = []
+        for name in await self.db.list_collection_names():
+            async for stats in self.db[name].aggregate([{"$collStats": {"storageStats": {}}}]):
+                storage = stats["storageStats"]
+                report.append({
+                    "collection": name,
+                    "count": storage.get("count", 0),
+                    "size": storage.get("size", 0),
+                    "storage_size": storage.get("storageSize", 0),
+                    "index_size": storage.get("totalIndexSize", 0),
+                    "index_sizes": storage.get("indexSizes", {})
+                })
+        
+        return sorted(report, key=lambda c: c["storage_size"] + c["index_size"], reverse=True)
+
+    async def get_stats_summary(self, days: int = 7) -> Dict:
+        """Get the user count and the last days' activity counters, cached for STATS_CACHE_TTL seconds"""
+        if self._stats_summary and time.monotonic() - self._stats_summary_at < STATS_CACHE_TTL:
+            return self._stats_summary
+        
+        daily = await activity_stats.get_daily(days)
+        totals = {}
+        for counts in daily.values():
+            for counter, amount in counts.items():
+                totals[counter] = totals.get(counter, 0) + amount
+        
+        self._stats_summary = {
+            "total_users": await self.db.users.count_documents({"is_active": True}),
+            "days": days,
+            "daily": daily,
+            "totals": totals,
+            "today": daily.get(datetime.utcnow().strftime("%Y-%m-%d"), {})
+        }
+        self._stats_summary_at = time.monotonic()
+        return self._stats_summary
+
     # User Management
     async def add_user(self, user_id: int, username: str = None, first_name: str = None):
-        """Add a new user to the database"""
-        user_data = {
-            "user_id": user_id,
-            "username": username,
-            "first_name": first_name,
-            "joined_date": datetime.utcnow(),
-            "is_active": True
-        }
-        try:
-            await self.db.users.insert_one(user_data)
-        except:
-            # User already exists, update info
-            await self.db.users.update_one(
-                {"user_id": user_id},
-                {"$set": {"username": username, "first_name": first_name, "is_active": True}}
-            )
+        """Add a new user to the database, or refresh an existing user's info"""
+        cached = self.user_cache.get(user_id)
+        # MISSING means not cached, None means cached as unknown: both need the upsert
+        if (cached is not LRUCache.MISSING and cached is not None
+                and cached.get("username") == username and cached.get("first_name") == first_name
+                and cached.get("is_active")):
+            return
+        
+        user = await self.db.users.find_one_and_update(
+            {"user_id": user_id},
+            {
+                "$set": {"username": username, "first_name": first_name, "is_active": True},
+                "$setOnInsert": {"joined_date": datetime.utcnow()}
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        self.user_cache.set(user_id, user)
 
     async def get_user(self, user_id: int) -> Optional[Dict]:
         """Get user information"""
-        return await self.db.users.find_one({"user_id": user_id})
+        user = self.user_cache.get(user_id)
+        if user is LRUCache.MISSING:
+            user = await self.db.users.find_one({"user_id": user_id})
+            self.user_cache.set(user_id, user)
+        return user
 
     async def is_user_exists(self, user_id: int) -> bool:
         """Check if user exists in database"""
-        user = await self.db.users.find_one({"user_id": user_id})
-        return user is not None
+        return await self.get_user(user_id) is not None
 
     async def get_all_users(self) -> List[Dict]:
         """Get all users from database"""
@@ -59,68 +185,183 @@ class Database:
         return users
 
     # Rate Limiting
-    async def check_rate_limit(self, user_id: int, command: str, limit: int, window: int) -> bool:
-        """Check if user has exceeded rate limit"""
-        cutoff_time = datetime.utcnow() - timedelta(seconds=window)
-        
-        # Count recent requests
-        count = await self.db.rate_limits.count_documents({
-            "user_id": user_id,
-            "command": command,
-            "timestamp": {"$gte": cutoff_time}
-        })
-        
-        return count < limit
-
-    async def record_request(self, user_id: int, command: str):
-        """Record a new request for rate limiting"""
-        await self.db.rate_limits.insert_one({
-            "user_id": user_id,
-            "command": command,
-            "timestamp": datetime.utcnow()
-        })
+    async def record_requests(self, requests: List[Dict]):
+        """Record a batch of requests for rate limiting"""
+        if requests:
+            await self.db.rate_limits.insert_many(requests, ordered=False)
 
-    async def cleanup_old_rate_limits(self, hours: int = 24):
-        """Clean up old rate limit records"""
-        cutoff_time = datetime.utcnow() - timedelta(hours=hours)
-        await self.db.rate_limits.delete_many({"timestamp": {"$lt": cutoff_time}})
+    async def get_recent_requests(self, window: int) -> List[Dict]:
+        """Get requests recorded within the last window seconds"""
+        cutoff_time = datetime.utcnow() - timedelta(seconds=window)
+        requests = []
+        async for request in self.db.rate_limits.find(
+            {"timestamp": {"$gte": cutoff_time}},
+            {"_id": 0, "user_id": 1, "command": 1, "timestamp": 1}
+        ):
+            requests.append(request)
+        return requests
 
     # Chat History
     async def save_chat_message(self, chat_id: int, user_id: int, message_text: str, username: str = None):
-        """Save chat message for analysis"""
-        await self.db.chat_history.insert_one({
+        """Queue chat message for analysis, written in the next chat_history batch"""
+        now = datetime.utcnow()
+        message = {
             "chat_id": chat_id,
             "user_id": user_id,
             "username": username,
             "message_text": message_text,
-            "timestamp": datetime.utcnow()
-        })
+            # MongoDB stores milliseconds; truncate so queued and stored copies compare equal
+            "timestamp": now.replace(microsecond=now.microsecond // 1000 * 1000)
+        }
+        self._recent_messages_for(chat_id).append(message)
+        activity_stats.increment("messages")
+        await self.chat_history_buffer.add(message)
+
+    def _recent_messages_for(self, chat_id: int) -> deque:
+        if chat_id not in self.recent_messages:
+            self.recent_messages[chat_id] = deque(maxlen=RECENT_CONTEXT_MESSAGES)
+        return self.recent_messages[chat_id]
 
-    async def get_chat_history(self, chat_id: int, days: int = 20) -> List[Dict]:
-        """Get chat history for the specified number of days"""
+    async def _load_newest_messages(self, chat_id: int, limit: int) -> List[Dict]:
+        """Load up to limit of the chat's newest stored messages, newest first"""
+        messages = []
+        async for message in self.db.chat_history.find(
+            {"chat_id": chat_id}
+        ).sort("timestamp", -1).limit(limit):
+            messages.append(message)
+        
+        if CHAT_HISTORY_BUCKETS:
+            bucketed = 0
+            async for bucket in self.db.chat_history_buckets.find(
+                {"chat_id": chat_id}, {"messages": {"$slice": -limit}}
+            ).sort([("bucket", -1), ("timestamp", -1)]).limit(limit):
+                expanded = expand_bucket(bucket)
+                messages.extend(expanded)
+                bucketed += len(expanded)
+                if bucketed >= limit:
+                    break
+        
+        messages.sort(key=lambda message: message["timestamp"], reverse=True)
+        return messages[:limit]
+
+    async def get_recent_messages(self, chat_id: int, days: int = 1) -> List[Dict]:
+        """Get the chat's last RECENT_CONTEXT_MESSAGES messages from the past days, oldest first
+        
+        Served from memory; the first call for a chat loads its newest messages from MongoDB.
+        """
+        if chat_id not in self.warmed_chats:
+            stored = await self._load_newest_messages(chat_id, RECENT_CONTEXT_MESSAGES)
+            
+            # Messages queued since startup may not be written yet; keep them alongside
+            message_key = lambda message: (message["user_id"], message["timestamp"], message["message_text"])
+            stored_keys = {message_key(message) for message in stored}
+            queued = [
+                message for message in self._recent_messages_for(chat_id)
+                if message_key(message) not in stored_keys
+            ]
+            self.recent_messages[chat_id] = deque(
+                sorted(stored + queued, key=lambda message: message["timestamp"]),
+                maxlen=RECENT_CONTEXT_MESSAGES
+            )
+            self.warmed_chats.add(chat_id)
+        
+        cutoff_time = datetime.utcnow() - timedelta(days=days)
+        return [message for message in self.recent_messages[chat_id] if message["timestamp"] >= cutoff_time]
+
+    async def get_chat_history(self, chat_id: int, days: int = 20, since: datetime = None) -> List[Dict]:
+        """Get chat history for the specified number of days, only messages after since if given"""
         cutoff_time = datetime.utcnow() - timedelta(days=days)
+        time_range = {"$gte": cutoff_time}
+        if since:
+            time_range["$gt"] = since
         messages = []
         
+        # Per-message documents: the only schema, or ones not migrated to buckets yet
         async for message in self.db.chat_history.find({
             "chat_id": chat_id,
-            "timestamp": {"$gte": cutoff_time}
+            "timestamp": time_range
         }).sort("timestamp", 1):
             messages.append(message)
         
+        if CHAT_HISTORY_BUCKETS:
+            bucketed = []
+            async for bucket in self.db.chat_history_buckets.find({
+                "chat_id": chat_id,
+                "bucket": {"$gte": bucket_start(max(cutoff_time, since or cutoff_time), CHAT_HISTORY_BUCKETS)}
+            }).sort([("bucket", 1), ("timestamp", 1)]):
+                bucketed.extend(
+                    message for message in expand_bucket(bucket)
+                    if message["timestamp"] >= cutoff_time and (not since or message["timestamp"] > since)
+                )
+            
+            # Nearly sorted already, so this is close to a linear merge
+            messages = sorted(messages + bucketed, key=lambda message: message["timestamp"])
+        
         return messages
 
-    async def cleanup_old_chat_history(self, days: int = 30):
-        """Clean up old chat history"""
-        cutoff_time = datetime.utcnow() - timedelta(days=days)
-        await self.db.chat_history.delete_many({"timestamp": {"$lt": cutoff_time}})
+    async def migrate_chat_history_to_buckets(self, batch_size: int = 5000) -> int:
+        """Move per-message chat_history documents into buckets, returning how many were moved
+        
+        Moved messages keep their source _id in the bucket, and each batch is deleted from
+        chat_history only once its buckets are written. Messages of a batch already found in
+        a bucket are not written again, so an interrupted or failed migration can be re-run.
+        """
+        if not CHAT_HISTORY_BUCKETS:
+            raise ValueError("Set CHAT_HISTORY_BUCKETS to hour or day before migrating")
+        
+        # Sparse, so only buckets written by the migration are indexed
+        await self.db.chat_history_buckets.create_index("messages.id", sparse=True)
+        moved = 0
+        while True:
+            batch = []
+            async for message in self.db.chat_history.find().sort(
+                [("chat_id", 1), ("timestamp", 1)]
+            ).limit(batch_size):
+                batch.append(message)
+            if not batch:
+                return moved
+            
+            ids = [message["_id"] for message in batch]
+            migrated = set()
+            async for bucket in self.db.chat_history_buckets.find(
+                {"messages.id": {"$in": ids}}, {"messages.id": 1}
+            ):
+                migrated.update(message.get("id") for message in bucket["messages"])
+            
+            pending = [message for message in batch if message["_id"] not in migrated]
+            if pending:
+                updates, _ = bucket_updates(pending, CHAT_HISTORY_BUCKETS, CHAT_HISTORY_BUCKET_SIZE, keep_ids=True)
+                await self.db.chat_history_buckets.bulk_write(updates, ordered=False)
+            await self.db.chat_history.delete_many({"_id": {"$in": ids}})
+            moved += len(batch)
+
+    # Chat Style Profiles
+    async def get_chat_style(self, chat_id: int) -> Optional[Dict]:
+        """Get a chat's stored style profile"""
+        return await self.db.chat_styles.find_one({"chat_id": chat_id})
+
+    async def save_chat_style(self, chat_id: int, style: str, high_water: datetime, version: int, analyzed_messages: int):
+        """Store a chat's style profile along with the newest message timestamp it covers"""
+        await self.db.chat_styles.update_one(
+            {"chat_id": chat_id},
+            {"$set": {
+                "style": style,
+                "high_water": high_water,
+                "version": version,
+                "analyzed_messages": analyzed_messages,
+                "updated_at": datetime.utcnow()
+            }},
+            upsert=True
+        )
 
     # Search Results Storage
     async def save_search_result(self, user_id: int, query: str, results: List[Dict], search_type: str):
-        """Save search results"""
-        await self.db.search_results.insert_one({
+        """Queue search results for storage in compact form: previews and links, not full texts"""
+        activity_stats.increment(f"searches.{search_type}")
+        await self.search_results_buffer.add({
             "user_id": user_id,
             "query": query,
-            "results": results,
+            **pack_results(results, SEARCH_RESULT_PREVIEW_CHARS, SEARCH_RESULTS_COMPRESS),
             "search_type": search_type,
             "timestamp": datetime.utcnow()
         })
@@ -133,19 +374,22 @@ class Database:
             
         searches = []
         async for search in self.db.search_results.find(query).sort("timestamp", -1).limit(10):
-            searches.append(search)
+            searches.append(unpack_results(search))
         
         return searches
 
     # LLM Settings
     async def set_user_llm_model(self, user_id: int, model: str):
         """Set user's preferred LLM model"""
-        await self.db.users.update_one(
+        user = await self.db.users.find_one_and_update(
             {"user_id": user_id},
-            {"$set": {"preferred_llm": model}}
+            {"$set": {"preferred_llm": model}},
+            return_document=ReturnDocument.AFTER
         )
+        # Write through, so the next lookup sees the new model without a round-trip
+        self.user_cache.set(user_id, user)
 
     async def get_user_llm_model(self, user_id: int) -> str:
         """Get user's preferred LLM model"""
-        user = await self.db.users.find_one({"user_id": user_id})
+        user = await self.get_user(user_id)
         return user.get("preferred_llm", "qwen") if user else "qwen"
\ No newline at end of file
@@ -0,0 +1,38 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+class LRUCache:
+    """Bounded mapping that evicts the least recently used entry and expires entries after ttl seconds"""
+    MISSING = object()
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (stored_at, value), least recently used first
+
+    def get(self, key: Hashable) -> Any:
+        """Get a cached value, or LRUCache.MISSING if absent or expired"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return self.MISSING
+        if time.monotonic() - entry[0] > self.ttl:
+            del self._entries[key]
+            return self.MISSING
+
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any):
+        """Cache a value, evicting the least recently used entry if full"""
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        """Drop a cached value"""
+        self._entries.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,74 @@
+import asyncio
+from typing import Any
+
+class PeriodicFlusher:
+    """Base for in-memory state written behind to MongoDB by a background task
+
+    The task flushes every flush_interval seconds, or sooner when woken. Subclasses
+    either override flush, or implement _take_pending, _write_pending and _requeue, in
+    which case whatever fails to write is kept for the next flush. Stopping lets a
+    write in flight finish rather than cancelling it halfway through, then flushes
+    what is left.
+    """
+    flush_name = "pending writes"  # used in error messages
+
+    def __init__(self, flush_interval: float):
+        self.flush_interval = flush_interval
+        self._flush_task = None
+        self._closing = False
+        self._wake = None
+
+    def _start_flushing(self):
+        if not self._flush_task:
+            self._closing = False
+            self._wake = asyncio.Event()
+            self._flush_task = asyncio.create_task(self._flush_periodically())
+
+    def _wake_flusher(self):
+        """Flush now instead of at the end of the interval"""
+        if self._wake:
+            self._wake.set()
+
+    def _take_pending(self) -> Any:
+        """Take everything pending, or return something falsy if there is nothing to write"""
+        return None
+
+    async def _write_pending(self, pending) -> Any:
+        """Write what _take_pending returned, returning the part that failed, if any"""
+        return None
+
+    def _requeue(self, failed):
+        """Put back what failed to write, ahead of anything queued meanwhile"""
+
+    async def flush(self):
+        """Write everything pending"""
+        pending = self._take_pending()
+        if not pending:
+            return
+
+        try:
+            failed = await self._write_pending(pending)
+        except Exception as e:
+            print(f"Error saving {self.flush_name}: {e}")
+            failed = pending
+        if failed:
+            # Keep them for the next flush
+            self._requeue(failed)
+
+    async def _flush_periodically(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def _stop_flushing(self):
+        """Stop the background task and flush what is left"""
+        if self._flush_task:
+            self._closing = True
+            self._wake.set()
+            await self._flush_task
+            self._flush_task = None
+        await self.flush()
@@ -0,0 +1,50 @@
+import json
+import zlib
+from typing import Any, Dict, List
+
+# Fields kept as they are, so stored links still open the message or article
+LINK_FIELDS = ("url", "link", "message_link")
+# Fields stored as a preview of at most preview_chars characters
+PREVIEW_FIELDS = ("text", "description")
+
+def _is_id(key: str) -> bool:
+    return key == "id" or key.endswith("_id")
+
+def compact_value(value: Any, preview_chars: int) -> Any:
+    """Shrink a stored result to its ids, links and text previews, dropping every other field
+
+    Nested lists and dicts (a search's tweets or articles) are compacted the same way
+    and dropped if nothing is left of them.
+    """
+    if isinstance(value, (list, tuple)):
+        return [item for item in (compact_value(item, preview_chars) for item in value) if item not in (None, {}, [])]
+    if not isinstance(value, dict):
+        return value
+
+    compacted = {}
+    for key, item in value.items():
+        if item in (None, "", [], {}):
+            continue
+        if isinstance(item, (dict, list, tuple)):
+            item = compact_value(item, preview_chars)
+            if not item:
+                continue
+        elif key in PREVIEW_FIELDS and isinstance(item, str):
+            item = item if len(item) <= preview_chars else item[:preview_chars] + "…"
+        elif key not in LINK_FIELDS and not _is_id(key):
+            continue
+        compacted[key] = item
+    return compacted
+
+def pack_results(results: List[Dict], preview_chars: int, compress: bool) -> Dict:
+    """Build the stored form of a search's results"""
+    compacted = compact_value(results, preview_chars)
+    if compress:
+        return {"results_z": zlib.compress(json.dumps(compacted, default=str).encode("utf-8"))}
+    return {"results": compacted}
+
+def unpack_results(document: Dict) -> Dict:
+    """Restore the results field of a stored search, whichever form it was saved in"""
+    if "results_z" in document:
+        document["results"] = json.loads(zlib.decompress(document.pop("results_z")).decode("utf-8"))
+    return document
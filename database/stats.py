@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+from typing import Dict
+from config import STATS_FLUSH_INTERVAL
+from database.periodic_flusher import PeriodicFlusher
+
+def _flatten(counts: Dict, prefix: str = "") -> Dict[str, int]:
+    """Turn nested counter documents back into dotted counter names"""
+    flat = {}
+    for key, value in counts.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+def _add_counts(target: Dict[str, int], counts: Dict[str, int]):
+    for counter, amount in counts.items():
+        target[counter] = target.get(counter, 0) + amount
+
+class ActivityStats(PeriodicFlusher):
+    """Daily activity counters kept in memory and added to the stats collection in the background
+
+    Counters are dotted names such as "messages" or "searches.chat_search"; each day is one
+    document keyed by its date, so reading a week of activity is a handful of _id lookups.
+    """
+    flush_name = "stats"
+
+    def __init__(self):
+        super().__init__(STATS_FLUSH_INTERVAL)
+        self.collection = None
+        self.pending = {}  # day -> {counter: amount} not yet written
+
+    def increment(self, counter: str, amount: int = 1):
+        """Add to today's value of a counter"""
+        _add_counts(self.pending.setdefault(datetime.utcnow().strftime("%Y-%m-%d"), {}), {counter: amount})
+
+    def start(self, collection):
+        """Start adding counters to a collection in the background"""
+        self.collection = collection
+        self._start_flushing()
+
+    def _take_pending(self) -> Dict[str, Dict[str, int]]:
+        if self.collection is None:
+            return {}
+        pending, self.pending = self.pending, {}
+        return pending
+
+    async def _write_pending(self, pending: Dict[str, Dict[str, int]]) -> Dict[str, Dict[str, int]]:
+        """Add pending counts to their day documents, returning the days that failed"""
+        failed = {}
+        for day, counts in pending.items():
+            try:
+                await self.collection.update_one({"_id": day}, {"$inc": counts}, upsert=True)
+            except Exception as e:
+                print(f"Error saving stats for {day}: {e}")
+                failed[day] = counts
+        return failed
+
+    def _requeue(self, failed: Dict[str, Dict[str, int]]):
+        for day, counts in failed.items():
+            _add_counts(self.pending.setdefault(day, {}), counts)
+
+    async def get_daily(self, days: int = 7) -> Dict[str, Dict[str, int]]:
+        """Get each of the last days' counters, including ones not written yet"""
+        first_day = (datetime.utcnow() - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+        daily = {}
+        if self.collection is not None:
+            async for document in self.collection.find({"_id": {"$gte": first_day}}):
+                daily[document["_id"]] = _flatten({k: v for k, v in document.items() if k != "_id"})
+
+        for day, counts in self.pending.items():
+            if day >= first_day:
+                _add_counts(daily.setdefault(day, {}), counts)
+        return daily
+
+    async def stop(self):
+        """Stop the background writer and flush what is left"""
+        await self._stop_flushing()
+
+# Global activity stats instance
+activity_stats = ActivityStats()
@@ -0,0 +1,91 @@
+import asyncio
+import time
+from typing import Dict, List
+from pymongo.errors import BulkWriteError
+from database.periodic_flusher import PeriodicFlusher
+
+class WriteBuffer(PeriodicFlusher):
+    """Collect documents for a collection and write them in unordered batches
+
+    A batch is written once batch_size documents are queued or flush_interval seconds
+    have passed, whichever comes first. Writers only wait when max_pending documents
+    are already queued, so a slow database slows ingestion down instead of growing
+    the queue without bound.
+    """
+    def __init__(self, collection, batch_size: int, flush_interval: float, max_pending: int):
+        super().__init__(flush_interval)
+        self.collection = collection
+        self.batch_size = batch_size
+        self.max_pending = max(max_pending, batch_size)
+        self.pending: List[Dict] = []
+        self._has_room = asyncio.Event()
+        self._has_room.set()
+        self._flush_lock = asyncio.Lock()
+        self.stats = {
+            "queued": 0,
+            "written": 0,
+            "failed": 0,
+            "flushes": 0,
+            "backpressure_waits": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0
+        }
+
+    def start(self):
+        """Start flushing in the background"""
+        self._start_flushing()
+
+    async def add(self, document: Dict):
+        """Queue a document, waiting only while the buffer is full"""
+        if len(self.pending) >= self.max_pending:
+            self.stats["backpressure_waits"] += 1
+        while len(self.pending) >= self.max_pending:
+            self._has_room.clear()
+            self._wake_flusher()
+            await self._has_room.wait()
+
+        self.pending.append(document)
+        self.stats["queued"] += 1
+        if len(self.pending) >= self.batch_size:
+            self._wake_flusher()
+
+    async def flush(self):
+        """Write everything queued so far"""
+        async with self._flush_lock:
+            while self.pending:
+                batch = self.pending[:self.batch_size]
+                del self.pending[:self.batch_size]
+                self._has_room.set()
+
+                started = time.monotonic()
+                try:
+                    written = await self._write(batch)
+                except Exception as e:
+                    written = 0
+                    print(f"Error writing {self.collection.name} batch: {e}")
+
+                elapsed_ms = (time.monotonic() - started) * 1000
+                self.stats["written"] += written
+                self.stats["failed"] += len(batch) - written
+                self.stats["flushes"] += 1
+                self.stats["last_flush_ms"] = elapsed_ms
+                self.stats["max_flush_ms"] = max(self.stats["max_flush_ms"], elapsed_ms)
+
+    async def _write(self, batch: List[Dict]) -> int:
+        """Write a batch, returning how many of its documents were stored"""
+        try:
+            await self.collection.insert_many(batch, ordered=False)
+            return len(batch)
+        except BulkWriteError as e:
+            # Unordered: everything but the failed documents was still written
+            written = e.details.get("nInserted", 0)
+            print(f"Error writing {self.collection.name} batch: {len(batch) - written} documents failed")
+            return written
+
+    def get_stats(self) -> Dict:
+        """Get write counters along with the current queue depth"""
+        return {**self.stats, "pending": len(self.pending)}
+
+    async def close(self):
+        """Stop the background flusher and write what is left"""
+        await self._stop_flushing()
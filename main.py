@@ -9,7 +9,9 @@ load_dotenv()
 
 from config import API_ID, API_HASH, BOT_TOKEN
 from database.database import Database
+from utils.helpers import rate_limiter
 from plugins import *
+from plugins.casual import llm_service
 
 # Setup logging
 logging.basicConfig(
@@ -33,9 +35,12 @@ class TelegramBot(Client):
         await super().start()
         self.db = Database()
         await self.db.connect()
+        await rate_limiter.start(self.db)
         logger.info("Bot started successfully!")
 
     async def stop(self):
+        await rate_limiter.stop()
+        await llm_service.aclose()
         if self.db:
             await self.db.close()
         await super().stop()
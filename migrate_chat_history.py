@@ -0,0 +1,22 @@
+import asyncio
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+from config import CHAT_HISTORY_BUCKETS
+from database.database import Database
+
+async def main():
+    """Move per-message chat_history documents into the bucketed schema"""
+    db = Database()
+    await db.connect()
+    try:
+        print(f"Migrating chat_history into {CHAT_HISTORY_BUCKETS} buckets...")
+        moved = await db.migrate_chat_history_to_buckets()
+        print(f"Done: moved {moved} messages.")
+    finally:
+        await db.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -2,13 +2,15 @@ import asyncio
 from pyrogram import Client, filters
 from pyrogram.types import Message
 from services.llm_service import LLMService
+from services.style_profiles import StyleProfiles
 from utils.helpers import (
     is_admin, message_tracker, check_rate_limit, 
-    record_command_usage
+    record_command_usage, stream_reply
 )
-from config import CHAT_HISTORY_DAYS
+from config import CHAT_HISTORY_DAYS, CASUAL_STREAMING
 
 llm_service = LLMService()
+style_profiles = StyleProfiles(llm_service)
 
 # Store casual mode settings per chat
 casual_mode_chats = {}  # chat_id -> {'enabled': bool, 'style': str, 'model': str}
@@ -54,19 +56,16 @@ async def toggle_casual_mode(client: Client, message: Message):
         )
         
         try:
-            # Get chat history for analysis
-            chat_history = await client.db.get_chat_history(chat_id, CHAT_HISTORY_DAYS)
+            # Stored style profile, analyzed only if missing or enough new messages arrived
+            style_analysis = await style_profiles.get_style(client.db, chat_id)
             
-            if not chat_history:
+            if not style_analysis:
                 await processing_msg.edit_text(
-                    "⚠️ **No chat history found**\n\n"
-                    "I need some message history to analyze the chat style. "
-                    "Send a few messages and try again, or I'll use a default friendly style."
+                    "⚠️ **Couldn't analyze the chat style**\n\n"
+                    "There's no message history to analyze yet, or the analysis failed. "
+                    "I'll use a default friendly style and try again next time."
                 )
                 style_analysis = "casual and friendly"
-            else:
-                # Analyze chat style
-                style_analysis = await llm_service.analyze_chat_style(chat_history)
             
             # Enable casual mode
             casual_mode_chats[chat_id] = {
@@ -105,19 +104,7 @@ async def handle_casual_chat(client: Client, message: Message):
     chat_id = message.chat.id
     user_id = message.from_user.id
     
-    # Skip if casual mode not enabled
-    if chat_id not in casual_mode_chats or not casual_mode_chats[chat_id]['enabled']:
-        # Still save chat history for potential future analysis
-        if message.text and message.from_user:
-            await client.db.save_chat_message(
-                chat_id, 
-                user_id, 
-                message.text, 
-                message.from_user.username
-            )
-        return
-    
-    # Save message to chat history
+    # Queue message for chat history, also when casual mode is off, for future analysis
     if message.text and message.from_user:
         await client.db.save_chat_message(
             chat_id, 
@@ -126,6 +113,13 @@ async def handle_casual_chat(client: Client, message: Message):
             message.from_user.username
         )
     
+    # Skip if casual mode not enabled
+    if chat_id not in casual_mode_chats or not casual_mode_chats[chat_id]['enabled']:
+        return
+    
+    # Keep the chat's style profile current as messages come in
+    style_profiles.note_message(client.db, chat_id)
+    
     # Track user messages
     message_tracker.record_user_message(chat_id, user_id)
     
@@ -161,24 +155,37 @@ async def handle_casual_chat(client: Client, message: Message):
     if should_respond:
         try:
             # Get recent context
-            recent_messages = await client.db.get_chat_history(chat_id, days=1)
-            recent_context = recent_messages[-20:] if recent_messages else []
+            recent_context = await client.db.get_recent_messages(chat_id, days=1)
             
             # Get chat settings
             chat_settings = casual_mode_chats[chat_id]
+            style = style_profiles.cached_style(chat_id, chat_settings['style'])
             
-            # Generate response
-            response = await llm_service.generate_casual_response(
-                message.text or "📷 [Media]",
-                chat_settings['style'],
-                recent_context,
-                chat_settings['model']
-            )
+            if CASUAL_STREAMING and llm_service.supports_streaming(chat_settings['model']):
+                # Show the response as it is generated
+                response = await stream_reply(
+                    message,
+                    llm_service.stream_casual_response(
+                        message.text or "📷 [Media]",
+                        style,
+                        recent_context,
+                        chat_settings['model']
+                    )
+                )
+            else:
+                # Generate response
+                response = await llm_service.generate_casual_response(
+                    message.text or "📷 [Media]",
+                    style,
+                    recent_context,
+                    chat_settings['model']
+                )
+                
+                if response:
+                    # Send response
+                    await message.reply_text(response)
             
             if response:
-                # Send response
-                await message.reply_text(response)
-                
                 # Record bot message
                 message_tracker.record_bot_message(chat_id)
                 await client.db.save_chat_message(
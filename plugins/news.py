@@ -1,11 +1,15 @@
-import os
 import asyncio
 from pyrogram import Client, filters
 from pyrogram.types import Message
 from services.news_service import NewsService
 from utils.helpers import (
     check_rate_limit, record_command_usage, is_admin,
-    get_max_results, create_results_file
+    get_max_results, send_results_document
+)
+
+RATE_LIMIT_MESSAGE = (
+    "⏰ You've reached your daily limit (3 info commands per day). "
+    "Try again tomorrow or contact an admin for unlimited access."
 )
 
 news_service = NewsService()
@@ -17,10 +21,7 @@ async def news_command(client: Client, message: Message):
     
     # Check rate limit
     if not await check_rate_limit(client.db, user_id, "news"):
-        await message.reply_text(
-            "⏰ You've reached your daily limit (3 info commands per day). "
-            "Try again tomorrow or contact an admin for unlimited access."
-        )
+        await message.reply_text(RATE_LIMIT_MESSAGE)
         return
     
     # Parse command
@@ -38,8 +39,10 @@ async def news_command(client: Client, message: Message):
         )
         return
     
-    # Record usage
-    await record_command_usage(client.db, user_id, "news")
+    # Record usage; a concurrent command may have taken the last slot since the check
+    if not await record_command_usage(client.db, user_id, "news"):
+        await message.reply_text(RATE_LIMIT_MESSAGE)
+        return
     
     # Send processing message
     processing_msg = await message.reply_text(
@@ -132,8 +135,6 @@ async def news_command(client: Client, message: Message):
             if len(articles) > 10 or await is_admin(user_id):
                 timestamp = message.date.strftime("%Y%m%d_%H%M%S")
                 filename = f"news_{query.replace(' ', '_')}_{timestamp}.txt"
-                filepath = os.path.join("downloads", filename)
-                os.makedirs("downloads", exist_ok=True)
                 
                 file_content = f"NEWS SEARCH RESULTS\n"
                 file_content += f"Query: {query}\n"
@@ -153,23 +154,16 @@ async def news_command(client: Client, message: Message):
                 file_content += "=" * 50 + "\n\n"
                 file_content += detailed
                 
-                with open(filepath, 'w', encoding='utf-8') as f:
-                    f.write(file_content)
-                
                 response_text += f"\n\n📎 **Detailed results attached**"
                 
                 await processing_msg.delete()
                 await message.reply_text(response_text)
-                await message.reply_document(
-                    filepath, 
+                await send_results_document(
+                    message,
+                    file_content,
+                    filename,
                     caption=f"Complete news results for: {query}"
                 )
-                
-                # Clean up file
-                try:
-                    os.remove(filepath)
-                except:
-                    pass
             else:
                 await processing_msg.edit_text(response_text)
         else:
@@ -202,10 +196,7 @@ async def crypto_command(client: Client, message: Message):
     
     # Check rate limit
     if not await check_rate_limit(client.db, user_id, "crypto"):
-        await message.reply_text(
-            "⏰ You've reached your daily limit (3 info commands per day). "
-            "Try again tomorrow or contact an admin for unlimited access."
-        )
+        await message.reply_text(RATE_LIMIT_MESSAGE)
         return
     
     # Parse command
@@ -223,8 +214,10 @@ async def crypto_command(client: Client, message: Message):
         )
         return
     
-    # Record usage
-    await record_command_usage(client.db, user_id, "crypto")
+    # Record usage; a concurrent command may have taken the last slot since the check
+    if not await record_command_usage(client.db, user_id, "crypto"):
+        await message.reply_text(RATE_LIMIT_MESSAGE)
+        return
     
     # Send processing message
     processing_msg = await message.reply_text(f"💰 Getting {symbol.upper()} price data...")
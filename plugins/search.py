@@ -1,15 +1,19 @@
-import os
 import asyncio
 from pyrogram import Client, filters
 from pyrogram.types import Message
-from services.telegram_scanner import TelegramScanner
+from services.scanner_pool import ScannerPool
 from utils.helpers import (
     check_rate_limit, record_command_usage, is_admin,
-    get_max_results, parse_search_command, parse_usaid_command, create_results_file,
-    truncate_text, send_long_message
+    get_max_results, parse_search_command, parse_usaid_command,
+    truncate_text, send_long_message, send_results_document
 )
 
-scanner = TelegramScanner()
+RATE_LIMIT_MESSAGE = (
+    "⏰ You've reached your daily search limit (3 searches per day). "
+    "Try again tomorrow or contact an admin for unlimited access."
+)
+
+scanner = ScannerPool()
 
 @Client.on_message(filters.command("search"))
 async def search_current_chat(client: Client, message: Message):
@@ -19,10 +23,7 @@ async def search_current_chat(client: Client, message: Message):
     
     # Check rate limit
     if not await check_rate_limit(client.db, user_id, "search"):
-        await message.reply_text(
-            "⏰ You've reached your daily search limit (3 searches per day). "
-            "Try again tomorrow or contact an admin for unlimited access."
-        )
+        await message.reply_text(RATE_LIMIT_MESSAGE)
         return
     
     # Parse command
@@ -39,8 +40,10 @@ async def search_current_chat(client: Client, message: Message):
         )
         return
     
-    # Record usage
-    await record_command_usage(client.db, user_id, "search")
+    # Record usage; a concurrent command may have taken the last slot since the check
+    if not await record_command_usage(client.db, user_id, "search"):
+        await message.reply_text(RATE_LIMIT_MESSAGE)
+        return
     
     # Send processing message
     processing_msg = await message.reply_text("🔍 Searching current chat...")
@@ -94,19 +97,13 @@ async def search_current_chat(client: Client, message: Message):
             }
             
             filename = f"search_{chat_id}_{message.date.strftime('%Y%m%d_%H%M%S')}.txt"
-            filepath = await scanner.export_results_to_file(search_data, filename)
+            document = await scanner.export_results(search_data, filename)
             
             result_text += f"\n📎 **Full results attached as file** ({len(results)} total)"
             
             await processing_msg.delete()
             await message.reply_text(result_text)
-            await message.reply_document(filepath, caption="Complete search results")
-            
-            # Clean up file
-            try:
-                os.remove(filepath)
-            except:
-                pass
+            await send_results_document(message, document, caption="Complete search results")
         else:
             await processing_msg.edit_text(result_text)
         
@@ -128,10 +125,7 @@ async def search_all_chats(client: Client, message: Message):
     
     # Check rate limit
     if not await check_rate_limit(client.db, user_id, "searchall"):
-        await message.reply_text(
-            "⏰ You've reached your daily search limit (3 searches per day). "
-            "Try again tomorrow or contact an admin for unlimited access."
-        )
+        await message.reply_text(RATE_LIMIT_MESSAGE)
         return
     
     # Parse command
@@ -147,8 +141,10 @@ async def search_all_chats(client: Client, message: Message):
         )
         return
     
-    # Record usage
-    await record_command_usage(client.db, user_id, "searchall")
+    # Record usage; a concurrent command may have taken the last slot since the check
+    if not await record_command_usage(client.db, user_id, "searchall"):
+        await message.reply_text(RATE_LIMIT_MESSAGE)
+        return
     
     # Send processing message
     processing_msg = await message.reply_text(
@@ -160,14 +156,11 @@ async def search_all_chats(client: Client, message: Message):
         # Get max results with user specification
         max_results = get_max_results(user_id, result_count)
         
-        # Search across all chats (get more than needed for sorting)
-        search_data = await scanner.search_across_all_chats(search_terms, 200)
+        # Search across all chats; results come back as the newest max_results hits
+        search_data = await scanner.search_across_all_chats(search_terms, max_results)
         
         results = search_data['results']
-        
-        # Sort results by date (most recent first) and limit to max_results
-        results.sort(key=lambda x: x.get('date', ''), reverse=True)
-        display_results = results[:max_results]
+        display_results = results
         
         if not results:
             await processing_msg.edit_text(
@@ -181,7 +174,10 @@ async def search_all_chats(client: Client, message: Message):
         result_text = f"🔍 **Global Search Results**\n\n"
         result_text += f"**Terms:** {', '.join(search_terms)}\n"
         result_text += f"**Found:** {search_data['total_found']} messages\n"
-        result_text += f"**Searched:** {search_data['searched_chats']} chats\n"
+        result_text += f"**Searched:** {search_data['searched_chats']} chats in {search_data['scan_time']:.1f}s"
+        if search_data.get('resumed_chats'):
+            result_text += f" ({search_data['resumed_chats']} resumed)"
+        result_text += "\n"
         result_text += f"**Showing:** {min(len(display_results), 10)} results\n\n"
         
         # Show top results
@@ -205,21 +201,17 @@ async def search_all_chats(client: Client, message: Message):
             'results': display_results,
             'total_found': search_data['total_found'],
             'searched_chats': search_data['searched_chats'],
-            'chat_summary': search_data['chat_summary']
+            'chat_summary': search_data['chat_summary'],
+            'chat_timings': search_data.get('chat_timings'),
+            'scan_time': search_data.get('scan_time')
         }
-        filepath = await scanner.export_results_to_file(sorted_search_data, filename)
+        document = await scanner.export_results(sorted_search_data, filename)
         
         result_text += f"\n📎 **Complete results in attached file**"
         
         await processing_msg.delete()
         await message.reply_text(result_text)
-        await message.reply_document(filepath, caption=f"Global search results for: {', '.join(search_terms)}")
-        
-        # Clean up file
-        try:
-            os.remove(filepath)
-        except:
-            pass
+        await send_results_document(message, document, caption=f"Global search results for: {', '.join(search_terms)}")
         
         # Save search to database
         await client.db.save_search_result(
@@ -239,10 +231,7 @@ async def search_user_messages(client: Client, message: Message):
     
     # Check rate limit
     if not await check_rate_limit(client.db, user_id, "usaid"):
-        await message.reply_text(
-            "⏰ You've reached your daily search limit (3 searches per day). "
-            "Try again tomorrow or contact an admin for unlimited access."
-        )
+        await message.reply_text(RATE_LIMIT_MESSAGE)
         return
     
     # Parse command
@@ -258,8 +247,10 @@ async def search_user_messages(client: Client, message: Message):
         )
         return
     
-    # Record usage
-    await record_command_usage(client.db, user_id, "usaid")
+    # Record usage; a concurrent command may have taken the last slot since the check
+    if not await record_command_usage(client.db, user_id, "usaid"):
+        await message.reply_text(RATE_LIMIT_MESSAGE)
+        return
     
     # Send processing message
     processing_msg = await message.reply_text(
@@ -271,14 +262,11 @@ async def search_user_messages(client: Client, message: Message):
         # Get max results with user specification
         max_results = get_max_results(user_id, result_count)
         
-        # Search for user's messages (get more for sorting)
-        search_data = await scanner.search_user_in_chats(username, search_terms, 200)
+        # Search for user's messages; results come back as the newest max_results hits
+        search_data = await scanner.search_user_in_chats(username, search_terms, max_results)
         
         results = search_data['results']
-        
-        # Sort results by date (most recent first) and limit to max_results
-        results.sort(key=lambda x: x.get('date', ''), reverse=True)
-        display_results = results[:max_results]
+        display_results = results
         
         if not results:
             await processing_msg.edit_text(
@@ -294,7 +282,10 @@ async def search_user_messages(client: Client, message: Message):
         result_text += f"**User:** @{search_data['target_username']}\n"
         result_text += f"**Terms:** {', '.join(search_terms)}\n"
         result_text += f"**Found:** {search_data['total_found']} messages\n"
-        result_text += f"**Searched:** {search_data['searched_chats']} chats\n"
+        result_text += f"**Searched:** {search_data['searched_chats']} chats in {search_data['scan_time']:.1f}s"
+        if search_data.get('resumed_chats'):
+            result_text += f" ({search_data['resumed_chats']} resumed)"
+        result_text += "\n"
         result_text += f"**Showing:** {min(len(display_results), 10)} results\n\n"
         
         # Show results
@@ -313,24 +304,21 @@ async def search_user_messages(client: Client, message: Message):
                 'total_found': search_data['total_found'],
                 'searched_chats': search_data['searched_chats'],
                 'chat_summary': search_data['chat_summary'],
+                'chat_timings': search_data.get('chat_timings'),
+                'scan_time': search_data.get('scan_time'),
                 'target_username': search_data['target_username']
             }
-            filepath = await scanner.export_results_to_file(sorted_search_data, filename)
+            document = await scanner.export_results(sorted_search_data, filename)
             
             result_text += f"\n📎 **Complete results in attached file**"
             
             await processing_msg.delete()
             await message.reply_text(result_text)
-            await message.reply_document(
-                filepath, 
+            await send_results_document(
+                message,
+                document,
                 caption=f"@{search_data['target_username']}'s messages containing: {', '.join(search_terms)}"
             )
-            
-            # Clean up file
-            try:
-                os.remove(filepath)
-            except:
-                pass
         else:
             await processing_msg.edit_text(result_text)
         
@@ -1,7 +1,11 @@
 from pyrogram import Client, filters
 from pyrogram.types import Message
 from database.database import Database
-from utils.helpers import is_admin
+from utils.helpers import is_admin, format_file_size, send_long_message
+from plugins.casual import llm_service
+
+def _format_latency(seconds) -> str:
+    return f"{seconds:.1f}s" if seconds is not None else "n/a"
 
 @Client.on_message(filters.command("start"))
 async def start_command(client: Client, message: Message):
@@ -97,6 +101,7 @@ async def help_command(client: Client, message: Message):
 • `/llm list` - Show available AI models
 • `/llm set claude` - Set AI model (claude/gpt/cohere/gemini)
 • `/stats` - Show bot statistics
+• `/dbstats` - Show collection and index sizes
 
 **📊 Rate Limits:**
 - Regular users: 3 info commands per day
@@ -122,26 +127,41 @@ async def stats_command(client: Client, message: Message):
         return
     
     try:
-        # Get database statistics
-        total_users = len(await client.db.get_all_users())
+        # Cached counters, maintained as activity happens
+        summary = await client.db.get_stats_summary()
+        totals = summary['totals']
+        today = summary['today']
         
-        # Get recent activity
-        from datetime import datetime, timedelta
-        recent_searches = await client.db.search_results.count_documents({
-            "timestamp": {"$gte": datetime.utcnow() - timedelta(days=7)}
-        })
+        searches = {
+            counter.split('.', 1)[1]: amount
+            for counter, amount in totals.items() if counter.startswith('searches.')
+        }
+        searches_today = sum(amount for counter, amount in today.items() if counter.startswith('searches.'))
+        llm_calls = sum(amount for counter, amount in totals.items() if counter.startswith('llm_calls'))
+        search_lines = "\n".join(
+            f"• {search_type.replace('_', ' ').title()}: {count}"
+            for search_type, count in sorted(searches.items(), key=lambda item: item[1], reverse=True)
+        ) or "• None yet"
+        provider_lines = "\n".join(
+            f"• {provider}: p50 {_format_latency(health['p50'])} | p95 {_format_latency(health['p95'])} | "
+            f"errors {health['error_rate']:.0%}{' | ⛔ circuit open' if health['circuit_open'] else ''}"
+            for provider, health in sorted(llm_service.router.snapshot().items())
+        ) or "• No calls yet"
         
         stats_text = f"""
 📊 **Bot Statistics**
 
-👥 **Users:** {total_users} total users
-🔍 **Activity:** {recent_searches} searches this week
+👥 **Users:** {summary['total_users']} total users
+🔍 **Activity:** {sum(searches.values())} searches in the last {summary['days']} days ({searches_today} today)
+
+**Searches by Type:**
+{search_lines}
 
-**Database Collections:**
-• Users: {total_users}
-• Rate Limits: Active tracking
-• Chat History: Stored for casual mode
-• Search Results: Cached for performance
+💬 **Messages ingested:** {totals.get('messages', 0)} ({today.get('messages', 0)} today)
+🧠 **LLM calls:** {llm_calls}
+
+**LLM Providers:**
+{provider_lines}
 
 **Features Status:**
 ✅ Telegram Scanning
@@ -159,12 +179,54 @@ async def stats_command(client: Client, message: Message):
     except Exception as e:
         await message.reply_text(f"❌ Error getting statistics: {str(e)}")
 
+@Client.on_message(filters.command("dbstats"))
+async def dbstats_command(client: Client, message: Message):
+    """Handle /dbstats command (admin only)"""
+    user_id = message.from_user.id
+    
+    if not await is_admin(user_id):
+        await message.reply_text("❌ This command is only available to administrators.")
+        return
+    
+    try:
+        report = await client.db.get_storage_report()
+        if not report:
+            await message.reply_text("No collections found.")
+            return
+        
+        stats_text = "🗄 **Database Storage**\n\n"
+        for collection in report:
+            stats_text += (
+                f"**{collection['collection']}:** {collection['count']} docs\n"
+                f"• Data: {format_file_size(collection['size'])} "
+                f"({format_file_size(collection['storage_size'])} on disk)\n"
+                f"• Indexes: {format_file_size(collection['index_size'])}\n"
+            )
+            for index_name, index_size in collection['index_sizes'].items():
+                stats_text += f"  ◦ `{index_name}`: {format_file_size(index_size)}\n"
+            stats_text += "\n"
+        
+        buffer_stats = client.db.chat_history_buffer.get_stats()
+        stats_text += (
+            "📥 **Chat History Writes**\n"
+            f"• Pending: {buffer_stats['pending']} | Written: {buffer_stats['written']} | "
+            f"Failed: {buffer_stats['failed']}\n"
+            f"• Batches: {buffer_stats['flushes']} | Last: {buffer_stats['last_flush_ms']:.0f}ms | "
+            f"Slowest: {buffer_stats['max_flush_ms']:.0f}ms\n"
+            f"• Backpressure waits: {buffer_stats['backpressure_waits']}\n"
+        )
+        
+        await send_long_message(client, message.chat.id, stats_text)
+        
+    except Exception as e:
+        await message.reply_text(f"❌ Error getting database statistics: {str(e)}")
+
 @Client.on_message(filters.command("ping"))
 async def ping_command(client: Client, message: Message):
     """Handle /ping command"""
     await message.reply_text("🏓 Pong! Bot is running normally.")
 
-@Client.on_message(filters.private & ~filters.command(['start', 'help', 'stats', 'ping', 'casual', 'casual_status', 'casual_reset', 'search', 'searchall', 'usaid', 'dialogs', 'news', 'crypto', 'tweets', 'llm']))
+@Client.on_message(filters.private & ~filters.command(['start', 'help', 'stats', 'dbstats', 'ping', 'casual', 'casual_status', 'casual_reset', 'search', 'searchall', 'usaid', 'dialogs', 'news', 'crypto', 'tweets', 'llm']))
 async def handle_private_message(client: Client, message: Message):
     """Handle private messages that aren't commands"""
     await message.reply_text(
@@ -0,0 +1,187 @@
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, Optional
+from config import (
+    LLM_LATENCY_WINDOW, LLM_CIRCUIT_FAILURES, LLM_CIRCUIT_COOLDOWN,
+    LLM_HEDGING, LLM_HEDGE_AFTER
+)
+
+# Latency samples needed before a provider's percentiles are trusted over defaults
+MIN_LATENCY_SAMPLES = 10
+
+class ProviderHealth:
+    """Rolling latency, error rate and circuit breaker state of one LLM provider"""
+    def __init__(self, window: int):
+        self.latencies = deque(maxlen=window)  # seconds, of successful calls
+        self.outcomes = deque(maxlen=window)  # True for success, False for failure
+        self.consecutive_failures = 0
+        self.open_until = 0.0  # circuit is open, and the provider skipped, until then
+        self.probing = False  # a half-open trial call is in flight
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Get the p-th percentile latency, or None without enough samples"""
+        if len(self.latencies) < MIN_LATENCY_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+class ProviderRouter:
+    """Pick LLM providers by health and latency, with circuit breakers and optional hedging
+
+    A provider's circuit opens after LLM_CIRCUIT_FAILURES consecutive failures and stays
+    open for LLM_CIRCUIT_COOLDOWN seconds; then a single trial call decides whether it
+    closes again. With LLM_HEDGING, a request still running after the primary provider's
+    p95 latency (LLM_HEDGE_AFTER seconds until that is known) is also sent to the next
+    provider, and whichever answers first wins; a call that fails while another is still
+    running is replaced by the next provider straight away.
+    """
+    def __init__(self):
+        self.health: Dict[str, ProviderHealth] = {}
+
+    def _health(self, provider: str) -> ProviderHealth:
+        if provider not in self.health:
+            self.health[provider] = ProviderHealth(LLM_LATENCY_WINDOW)
+        return self.health[provider]
+
+    def is_available(self, provider: str) -> bool:
+        """Check if a provider may be called: circuit closed, or half-open with no trial running"""
+        health = self._health(provider)
+        if health.consecutive_failures < LLM_CIRCUIT_FAILURES:
+            return True
+        return time.monotonic() >= health.open_until and not health.probing
+
+    def claim(self, provider: str) -> Optional[bool]:
+        """Claim a provider for a call: None if it is unavailable, True if the call is its trial
+
+        A half-open provider is marked as probing right here, before any await, so concurrent
+        requests can't all pick it; release the claim once the call is over.
+        """
+        if not self.is_available(provider):
+            return None
+        health = self._health(provider)
+        if health.consecutive_failures >= LLM_CIRCUIT_FAILURES:
+            health.probing = True
+            return True
+        return False
+
+    def release(self, provider: str, probe: bool):
+        """End a claimed call, letting another trial call through if this one was one"""
+        if probe:
+            self._health(provider).probing = False
+
+    def record_success(self, provider: str, latency: Optional[float] = None):
+        """Record a successful call, closing the provider's circuit"""
+        health = self._health(provider)
+        if latency is not None:
+            health.latencies.append(latency)
+        health.outcomes.append(True)
+        health.consecutive_failures = 0
+
+    def record_failure(self, provider: str):
+        """Record a failed call, opening the provider's circuit once failures repeat"""
+        health = self._health(provider)
+        health.outcomes.append(False)
+        health.consecutive_failures += 1
+        if health.consecutive_failures >= LLM_CIRCUIT_FAILURES:
+            health.open_until = time.monotonic() + LLM_CIRCUIT_COOLDOWN
+
+    def rank(self, providers: List[str], preferred: Optional[str] = None) -> List[str]:
+        """Order available providers: the preferred one first, the rest fastest p50 first
+
+        Providers without enough samples keep their given order, after measured ones.
+        """
+        available = [provider for provider in providers if self.is_available(provider)]
+        fallbacks = [provider for provider in available if provider != preferred]
+        fallbacks.sort(key=lambda provider: (
+            self._health(provider).percentile(50) is None,
+            self._health(provider).percentile(50) or 0.0
+        ))
+        return ([preferred] if preferred in available else []) + fallbacks
+
+    def _hedge_delay(self, provider: str) -> float:
+        return self._health(provider).percentile(95) or LLM_HEDGE_AFTER
+
+    async def _attempt(self, provider: str, request: Callable[[str], Awaitable[str]], probe: bool) -> str:
+        """Call a claimed provider, recording latency and outcome; empty responses count as failures"""
+        started = time.monotonic()
+        try:
+            result = await request(provider)
+        except asyncio.CancelledError:
+            # Lost a hedge race: says nothing about the provider's health
+            raise
+        except Exception as e:
+            print(f"Error calling {provider}: {e}")
+            self.record_failure(provider)
+            raise
+        finally:
+            self.release(provider, probe)
+
+        if not result:
+            self.record_failure(provider)
+            raise ValueError(f"{provider} returned an empty response")
+        self.record_success(provider, time.monotonic() - started)
+        return result
+
+    async def call(
+        self,
+        providers: List[str],
+        request: Callable[[str], Awaitable[str]],
+        preferred: Optional[str] = None
+    ) -> Optional[str]:
+        """Run request(provider) on the best providers in turn, returning the first result
+
+        Returns None if every provider failed or none is available.
+        """
+        queue = self.rank(providers, preferred)
+        running = {}  # task -> (provider, started)
+
+        def start_next():
+            while queue:
+                provider = queue.pop(0)
+                # Ranked before earlier attempts ran, so another request may have taken its trial since
+                probe = self.claim(provider)
+                if probe is not None:
+                    task = asyncio.create_task(self._attempt(provider, request, probe))
+                    running[task] = (provider, time.monotonic())
+                    return
+
+        start_next()
+        while running:
+            timeout = None
+            if LLM_HEDGING and queue and len(running) == 1:
+                provider, started = next(iter(running.values()))
+                timeout = max(0.0, started + self._hedge_delay(provider) - time.monotonic())
+
+            done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                # Too slow: hedge with the next provider
+                start_next()
+                continue
+
+            for task in done:
+                del running[task]
+                if not task.exception():
+                    for loser in running:
+                        loser.cancel()
+                    return task.result()
+                start_next()
+        return None
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """Get each provider's latency percentiles, error rate and circuit state"""
+        return {
+            provider: {
+                "p50": health.percentile(50),
+                "p95": health.percentile(95),
+                "error_rate": health.error_rate,
+                "circuit_open": not self.is_available(provider)
+            }
+            for provider, health in self.health.items()
+        }
@@ -0,0 +1,208 @@
+import sqlite3
+from typing import List, Dict, Optional
+from config import MESSAGE_INDEX_PATH
+from services.sqlite_store import SQLiteStore
+from utils.helpers import is_literal_term
+
+# Trigram FTS5 supports case-insensitive substring queries, but only for terms of 3+ characters
+MIN_FTS_TERM_LENGTH = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    chat_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    user_id INTEGER,
+    username TEXT,
+    first_name TEXT,
+    text TEXT NOT NULL,
+    date TEXT NOT NULL,
+    PRIMARY KEY (chat_id, message_id)
+);
+
+-- Serves (user_id, chat_id) -> message ids lookups for per-user searches
+CREATE INDEX IF NOT EXISTS messages_by_user ON messages (user_id, chat_id, message_id);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    text, content='messages', content_rowid='rowid', tokenize='trigram'
+);
+
+CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts(rowid, text) VALUES (new.rowid, new.text);
+END;
+
+CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+END;
+
+CREATE TABLE IF NOT EXISTS sync_state (
+    chat_id INTEGER PRIMARY KEY,
+    high_water INTEGER NOT NULL,
+    low_water INTEGER NOT NULL,
+    covered INTEGER NOT NULL,
+    synced_at TEXT
+);
+
+-- Ranges of message ids skipped when more messages arrived between syncs than one sync walks;
+-- messages with lower < message_id < upper are not indexed yet
+CREATE TABLE IF NOT EXISTS sync_gaps (
+    chat_id INTEGER NOT NULL,
+    lower INTEGER NOT NULL,
+    upper INTEGER NOT NULL,
+    PRIMARY KEY (chat_id, upper)
+);
+
+CREATE TABLE IF NOT EXISTS user_sync_state (
+    user_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    high_water INTEGER NOT NULL,
+    synced_at TEXT,
+    PRIMARY KEY (user_id, chat_id)
+);
+
+-- The same as sync_gaps, for one user's messages in a chat
+CREATE TABLE IF NOT EXISTS user_sync_gaps (
+    user_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    lower INTEGER NOT NULL,
+    upper INTEGER NOT NULL,
+    PRIMARY KEY (user_id, chat_id, upper)
+);
+"""
+
+class MessageIndex(SQLiteStore):
+    """Persistent on-disk full-text index of scanned chat history"""
+    schema = SCHEMA
+
+    def __init__(self, path: str = MESSAGE_INDEX_PATH):
+        super().__init__(path)
+
+    async def get_sync_state(self, chat_id: int) -> Optional[Dict]:
+        """Get a chat's sync marks, or None if it was never synced
+
+        high_water is the newest message_id walked, low_water the oldest (0 once the
+        start of the chat was reached), covered the number of history messages walked
+        and gaps the {lower, upper} ranges below high_water still to be backfilled.
+        """
+        def query(conn, chat_id):
+            row = conn.execute(
+                "SELECT high_water, low_water, covered FROM sync_state WHERE chat_id = ?", (chat_id,)
+            ).fetchone()
+            if not row:
+                return None
+            gaps = conn.execute(
+                "SELECT lower, upper FROM sync_gaps WHERE chat_id = ? ORDER BY upper DESC", (chat_id,)
+            ).fetchall()
+            return dict(row, gaps=[dict(gap) for gap in gaps])
+        return await self._run(query, chat_id)
+
+    async def add_messages(self, chat_id: int, messages: List[Dict], state: Dict):
+        """Store newly fetched messages and save the chat's new sync marks"""
+        def write(conn, chat_id, messages, state):
+            with conn:
+                self._insert_messages(conn, chat_id, messages)
+                conn.execute(
+                    "INSERT OR REPLACE INTO sync_state "
+                    "(chat_id, high_water, low_water, covered, synced_at) "
+                    "VALUES (?, ?, ?, ?, datetime('now'))",
+                    (chat_id, state["high_water"], state["low_water"], state["covered"])
+                )
+                conn.execute("DELETE FROM sync_gaps WHERE chat_id = ?", (chat_id,))
+                conn.executemany(
+                    "INSERT INTO sync_gaps (chat_id, lower, upper) VALUES (?, ?, ?)",
+                    [(chat_id, gap["lower"], gap["upper"]) for gap in state.get("gaps", [])]
+                )
+        await self._run(write, chat_id, messages, state)
+
+    def _insert_messages(self, conn: sqlite3.Connection, chat_id: int, messages: List[Dict]):
+        conn.executemany(
+            "INSERT OR IGNORE INTO messages "
+            "(chat_id, message_id, user_id, username, first_name, text, date) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (chat_id, msg["message_id"], msg["user_id"], msg["username"],
+                 msg["first_name"], msg["text"], msg["date"])
+                for msg in messages
+            ]
+        )
+
+    async def get_user_sync_state(self, user_id: int, chat_id: int) -> Dict:
+        """Get the newest message_id of a user's messages indexed for a chat, and the gaps below it"""
+        def query(conn, user_id, chat_id):
+            row = conn.execute(
+                "SELECT high_water FROM user_sync_state WHERE user_id = ? AND chat_id = ?",
+                (user_id, chat_id)
+            ).fetchone()
+            gaps = conn.execute(
+                "SELECT lower, upper FROM user_sync_gaps WHERE user_id = ? AND chat_id = ? ORDER BY upper DESC",
+                (user_id, chat_id)
+            ).fetchall()
+            return {"high_water": row["high_water"] if row else 0, "gaps": [dict(gap) for gap in gaps]}
+        return await self._run(query, user_id, chat_id)
+
+    async def add_user_messages(
+        self, user_id: int, chat_id: int, messages: List[Dict], high_water: int, gaps: List[Dict]
+    ):
+        """Store a user's newly fetched messages in a chat and save their new sync marks"""
+        def write(conn, user_id, chat_id, messages, high_water, gaps):
+            with conn:
+                self._insert_messages(conn, chat_id, messages)
+                conn.execute(
+                    "INSERT INTO user_sync_state (user_id, chat_id, high_water, synced_at) "
+                    "VALUES (?, ?, ?, datetime('now')) "
+                    "ON CONFLICT(user_id, chat_id) DO UPDATE SET "
+                    "high_water = max(high_water, excluded.high_water), synced_at = excluded.synced_at",
+                    (user_id, chat_id, high_water)
+                )
+                conn.execute(
+                    "DELETE FROM user_sync_gaps WHERE user_id = ? AND chat_id = ?", (user_id, chat_id)
+                )
+                conn.executemany(
+                    "INSERT INTO user_sync_gaps (user_id, chat_id, lower, upper) VALUES (?, ?, ?, ?)",
+                    [(user_id, chat_id, gap["lower"], gap["upper"]) for gap in gaps]
+                )
+        await self._run(write, user_id, chat_id, messages, high_water, gaps)
+
+    async def find_user_messages(self, user_id: int, chat_id: int) -> List[Dict]:
+        """Get a user's indexed messages in a chat, newest first"""
+        def query(conn, user_id, chat_id):
+            rows = conn.execute(
+                "SELECT * FROM messages WHERE user_id = ? AND chat_id = ? ORDER BY message_id DESC",
+                (user_id, chat_id)
+            ).fetchall()
+            return [dict(row) for row in rows]
+        return await self._run(query, user_id, chat_id)
+
+    async def find_user_id(self, username: str) -> Optional[int]:
+        """Look up the user id last seen with a username, for users Telegram can no longer resolve"""
+        def query(conn, username):
+            row = conn.execute(
+                "SELECT user_id FROM messages WHERE username = ? COLLATE NOCASE AND user_id IS NOT NULL "
+                "ORDER BY date DESC LIMIT 1",
+                (username,)
+            ).fetchone()
+            return row["user_id"] if row else None
+        return await self._run(query, username)
+
+    async def find_candidates(self, chat_id: int, search_terms: List[str], limit: int) -> List[Dict]:
+        """Get indexed messages of a chat that may match any term, newest first
+
+        Literal terms of 3+ characters are answered by the FTS index. Regex or very
+        short terms cannot be, so the chat's newest `limit` messages are returned for
+        the caller to match, as a scan of its history would.
+        """
+        def query(conn, chat_id, search_terms, limit):
+            if all(is_literal_term(term) and len(term) >= MIN_FTS_TERM_LENGTH for term in search_terms):
+                match = " OR ".join('"' + term.replace('"', '""') + '"' for term in search_terms)
+                rows = conn.execute(
+                    "SELECT m.* FROM messages_fts f JOIN messages m ON m.rowid = f.rowid "
+                    "WHERE messages_fts MATCH ? AND m.chat_id = ? "
+                    "ORDER BY m.message_id DESC",
+                    (match, chat_id)
+                ).fetchall()
+            else:
+                rows = conn.execute(
+                    "SELECT * FROM messages WHERE chat_id = ? ORDER BY date DESC, message_id DESC LIMIT ?",
+                    (chat_id, limit)
+                ).fetchall()
+            return [dict(row) for row in rows]
+        return await self._run(query, chat_id, search_terms, limit)
@@ -0,0 +1,90 @@
+import math
+from typing import Dict, List
+from config import PROMPT_MESSAGE_MAX_TOKENS
+
+try:
+    import tiktoken
+    _openai_encoding = tiktoken.get_encoding("cl100k_base")
+except ImportError:
+    _openai_encoding = None
+
+# Average characters per token of each provider's tokenizer, for providers without a local one.
+# Deliberately on the low side so estimates err towards smaller prompts.
+CHARS_PER_TOKEN = {
+    "claude": 3.5,
+    "gpt": 4.0,
+    "cohere": 4.0,
+    "gemini": 4.0,
+    "deepseek": 3.5,
+    "qwen": 3.0
+}
+
+class Prompt:
+    """A prompt split into a stable prefix and a per-request body
+
+    The prefix holds only what stays the same across requests for a chat (instructions,
+    style analysis), so providers that cache prompt prefixes can reuse it.
+    """
+    def __init__(self, prefix: str, body: str):
+        self.prefix = prefix
+        self.body = body
+
+    @property
+    def text(self) -> str:
+        return f"{self.prefix}\n\n{self.body}"
+
+def count_tokens(text: str, provider: str) -> int:
+    """Count or estimate how many tokens a provider's tokenizer makes of text"""
+    if provider == "gpt" and _openai_encoding:
+        return len(_openai_encoding.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / CHARS_PER_TOKEN.get(provider, 3.5))
+
+def truncate_to_tokens(text: str, max_tokens: int, provider: str) -> str:
+    """Cut text down to at most max_tokens tokens"""
+    if count_tokens(text, provider) <= max_tokens:
+        return text
+
+    # Shrink proportionally until it fits; converges in a step or two
+    while text and count_tokens(text + "…", provider) > max_tokens:
+        ratio = max_tokens / count_tokens(text + "…", provider)
+        text = text[:max(0, min(len(text) - 1, int(len(text) * ratio)))]
+    return text + "…"
+
+def format_messages(messages: List[Dict], provider: str) -> List[str]:
+    """Render chat messages as "username: text" lines, each capped at PROMPT_MESSAGE_MAX_TOKENS"""
+    return [
+        f"{msg.get('username') or 'User'}: "
+        f"{truncate_to_tokens(msg['message_text'], PROMPT_MESSAGE_MAX_TOKENS, provider)}"
+        for msg in messages
+    ]
+
+def fit_newest(lines: List[str], budget: int, provider: str) -> List[str]:
+    """Keep the newest lines whose tokens fit the budget, dropping the oldest, in original order"""
+    kept = []
+    for line in reversed(lines):
+        # +1 for the newline joining it to the others
+        cost = count_tokens(line, provider) + 1
+        if cost > budget:
+            break
+        kept.append(line)
+        budget -= cost
+    kept.reverse()
+    return kept
+
+def build_prompt(
+    provider: str,
+    prefix: str,
+    body_head: str,
+    messages: List[Dict],
+    body_tail: str,
+    budget: int
+) -> Prompt:
+    """Assemble a prompt within budget tokens for a provider
+
+    The prefix, body_head and body_tail are always kept; chat messages fill whatever
+    budget is left, oldest dropped first.
+    """
+    fixed = count_tokens(prefix, provider) + count_tokens(body_head, provider) + count_tokens(body_tail, provider)
+    lines = fit_newest(format_messages(messages, provider), budget - fixed, provider)
+    body = "\n\n".join(part for part in (body_head, "\n".join(lines), body_tail) if part)
+    return Prompt(prefix, body)
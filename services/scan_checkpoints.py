@@ -0,0 +1,80 @@
+import hashlib
+import json
+import time
+from typing import List, Dict
+from config import SCAN_CHECKPOINT_PATH, SCAN_CHECKPOINT_TTL
+from services.sqlite_store import SQLiteStore
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scan_checkpoints (
+    job_id TEXT NOT NULL,
+    chat_id INTEGER NOT NULL,
+    max_results INTEGER NOT NULL,
+    complete INTEGER NOT NULL,
+    results TEXT NOT NULL,
+    saved_at REAL NOT NULL,
+    PRIMARY KEY (job_id, chat_id)
+);
+
+CREATE INDEX IF NOT EXISTS scan_checkpoints_age ON scan_checkpoints (saved_at);
+"""
+
+class ScanCheckpoints(SQLiteStore):
+    """Per-chat progress of multi-chat search jobs, so a retried search resumes
+
+    Only jobs that did not finish are resumed: the scanner clears a job's checkpoints
+    once all of its chats were tried, whether or not some failed.
+    """
+    schema = SCHEMA
+
+    def __init__(self, path: str = SCAN_CHECKPOINT_PATH, ttl: int = SCAN_CHECKPOINT_TTL):
+        super().__init__(path)
+        self.ttl = ttl
+
+    @staticmethod
+    def job_id(kind: str, search_terms: List[str], target: str = None) -> str:
+        """Identify a search job by what it searches for, so reruns map to the same job"""
+        key = json.dumps({
+            "kind": kind,
+            "terms": sorted(term.lower() for term in search_terms),
+            "target": target.lower() if target else None
+        })
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    async def load(self, job_id: str, max_results: int) -> Dict[int, List[Dict]]:
+        """Get the stored results of every chat this job can reuse, by chat id
+
+        A chat is reusable if it was scanned to its limit, or if it was cut short by a
+        top-K threshold at least as wide as the one asked for now.
+        """
+        def query(conn, job_id, max_results):
+            with conn:
+                conn.execute(
+                    "DELETE FROM scan_checkpoints WHERE saved_at < ?", (time.time() - self.ttl,)
+                )
+            rows = conn.execute(
+                "SELECT chat_id, results FROM scan_checkpoints "
+                "WHERE job_id = ? AND (complete = 1 OR max_results >= ?)",
+                (job_id, max_results)
+            ).fetchall()
+            return {row["chat_id"]: json.loads(row["results"]) for row in rows}
+        return await self._run(query, job_id, max_results)
+
+    async def save(self, job_id: str, chat_id: int, results: List[Dict], complete: bool, max_results: int):
+        """Record that a chat of this job finished scanning with these results"""
+        def write(conn, job_id, chat_id, payload, complete, max_results):
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO scan_checkpoints "
+                    "(job_id, chat_id, max_results, complete, results, saved_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (job_id, chat_id, max_results, int(complete), payload, time.time())
+                )
+        await self._run(write, job_id, chat_id, json.dumps(results), complete, max_results)
+
+    async def clear(self, job_id: str):
+        """Drop every checkpoint of a job"""
+        def delete(conn, job_id):
+            with conn:
+                conn.execute("DELETE FROM scan_checkpoints WHERE job_id = ?", (job_id,))
+        await self._run(delete, job_id)
@@ -0,0 +1,68 @@
+from typing import List, Dict
+from config import SCANNER_SESSIONS, SCANNER_CONCURRENCY
+from services.telegram_scanner import TelegramScanner
+
+# Private chats have the same id in every account but different contents, and basic
+# groups number their messages separately for each account, so message ids (and the
+# shared index's sync marks) only agree within one account: read them on the primary
+PRIMARY_ONLY_TYPES = ("private", "bot", "group")
+
+class ScannerPool(TelegramScanner):
+    """Scanner that shards chat scans across several user account sessions
+
+    The pool itself is the primary session. Each dialog is routed to the least loaded
+    session that can read it, steering away from accounts with recent FloodWaits, and
+    all sessions feed the same top-K merge, so callers see a single scanner.
+    """
+    def __init__(self, session_names: List[str] = SCANNER_SESSIONS, concurrency: int = SCANNER_CONCURRENCY):
+        super().__init__(session_names[0], concurrency)
+        self.sessions = [self]
+        self._access = {}  # chat_id -> sessions that can read it
+        
+        for name in session_names[1:]:
+            session = TelegramScanner(name, concurrency)
+            # One index and one checkpoint store for the whole pool
+            session.index = self.index
+            session.checkpoints = None
+            # Its membership changes must also refresh the pool's merged dialog list
+            session.pool = self
+            self.sessions.append(session)
+
+    async def connect(self):
+        """Connect every session in the pool"""
+        await super().connect()
+        for session in self.sessions[1:]:
+            await session.connect()
+
+    async def disconnect(self):
+        """Disconnect every session in the pool"""
+        for session in self.sessions[1:]:
+            session.index = None  # Closed once by the primary
+            await session.disconnect()
+        await super().disconnect()
+
+    async def _fetch_dialogs(self) -> List[Dict]:
+        """Merge the dialogs of all sessions and remember which sessions can read each chat"""
+        dialogs = await super()._fetch_dialogs()
+        access = {dialog["id"]: [self] for dialog in dialogs}
+        
+        for session in self.sessions[1:]:
+            try:
+                session_dialogs = await session.get_dialogs()
+            except Exception as e:
+                print(f"Error getting dialogs for session {session.client.name}: {e}")
+                continue
+            
+            for dialog in session_dialogs:
+                if dialog["type"] in PRIMARY_ONLY_TYPES:
+                    continue
+                if dialog["id"] not in access:
+                    dialogs.append(dialog)
+                    access[dialog["id"]] = []
+                access[dialog["id"]].append(session)
+        
+        self._access = access
+        return dialogs
+
+    def _sessions_for(self, dialog: Dict) -> List[TelegramScanner]:
+        return self._access.get(dialog["id"]) or [self]
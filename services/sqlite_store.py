@@ -0,0 +1,42 @@
+import asyncio
+import os
+import sqlite3
+import threading
+
+class SQLiteStore:
+    """Base for small local SQLite stores used from async code"""
+    schema = ""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = None
+        # sqlite3 connections are shared across worker threads, so serialize access
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(self.schema)
+        return self._conn
+
+    async def _run(self, func, *args):
+        """Run a blocking database operation off the event loop"""
+        def call():
+            with self._lock:
+                return func(self._connection(), *args)
+        return await asyncio.to_thread(call)
+
+    async def close(self):
+        """Close the database"""
+        def close():
+            with self._lock:
+                if self._conn is not None:
+                    self._conn.close()
+                    self._conn = None
+        await asyncio.to_thread(close)
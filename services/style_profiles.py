@@ -0,0 +1,119 @@
+import asyncio
+from datetime import datetime
+from typing import Dict, Optional
+from config import (
+    CHAT_HISTORY_DAYS, STYLE_REFRESH_MESSAGES, STYLE_REFRESH_MIN_MESSAGES, STYLE_REFRESH_INTERVAL
+)
+from services.llm_service import LLMService
+
+class StyleProfiles:
+    """Per-chat style analyses, persisted and refreshed from new messages only
+
+    A profile records the timestamp of the newest message it covers (its high-water mark)
+    and a version. Refreshes send the previous analysis plus messages past the mark to the
+    model, rather than re-reading the chat's whole history.
+    """
+    def __init__(self, llm_service: LLMService):
+        self.llm_service = llm_service
+        self.profiles: Dict[int, Dict] = {}  # chat_id -> profile last loaded or saved
+        self.new_messages: Dict[int, int] = {}  # chat_id -> messages seen since the last analysis
+        self._refreshing = set()  # chats with a refresh in progress
+
+    async def _load(self, db, chat_id: int) -> Optional[Dict]:
+        if chat_id not in self.profiles:
+            profile = await db.get_chat_style(chat_id)
+            if profile:
+                self.profiles[chat_id] = profile
+        return self.profiles.get(chat_id)
+
+    async def _save(self, db, chat_id: int, style: str, high_water: datetime, version: int, analyzed: int) -> Dict:
+        await db.save_chat_style(chat_id, style, high_water, version, analyzed)
+        self.profiles[chat_id] = {
+            "chat_id": chat_id,
+            "style": style,
+            "high_water": high_water,
+            "version": version,
+            "analyzed_messages": analyzed,
+            "updated_at": datetime.utcnow()
+        }
+        self.new_messages[chat_id] = 0
+        return self.profiles[chat_id]
+
+    async def get_style(self, db, chat_id: int) -> Optional[str]:
+        """Get a chat's style, analyzing its history only if it has no profile yet
+
+        A stored profile is returned right away; if it is older than STYLE_REFRESH_INTERVAL
+        it is refreshed in the background. Returns None if the chat has no stored profile
+        and its history is empty or could not be analyzed; nothing is saved then, so the
+        next call tries again.
+        """
+        profile = await self._load(db, chat_id)
+        if not profile:
+            history = await db.get_chat_history(chat_id, CHAT_HISTORY_DAYS)
+            if not history:
+                return None
+            style = await self.llm_service.analyze_chat_style(history)
+            if not style:
+                return None
+            await self._save(db, chat_id, style, history[-1]["timestamp"], 1, len(history))
+            return style
+
+        if (datetime.utcnow() - profile["updated_at"]).total_seconds() >= STYLE_REFRESH_INTERVAL:
+            asyncio.create_task(self._refresh_in_background(db, chat_id))
+        return profile["style"]
+
+    async def refresh(self, db, chat_id: int, min_messages: int) -> Dict:
+        """Fold messages past a profile's high-water mark into it, if there are at least min_messages
+
+        If the analysis fails the profile is kept as it was, high-water mark included, so
+        the same messages are folded in by the next refresh.
+        """
+        profile = await self._load(db, chat_id)
+        if not profile or chat_id in self._refreshing:
+            return profile
+
+        self._refreshing.add(chat_id)
+        try:
+            new_messages = await db.get_chat_history(chat_id, CHAT_HISTORY_DAYS, since=profile["high_water"])
+            if len(new_messages) < min_messages:
+                return profile
+
+            style = await self.llm_service.refine_chat_style(profile["style"], new_messages)
+            if not style:
+                return profile
+            return await self._save(
+                db, chat_id, style, new_messages[-1]["timestamp"],
+                profile.get("version", 1) + 1, profile.get("analyzed_messages", 0) + len(new_messages)
+            )
+        finally:
+            self._refreshing.discard(chat_id)
+
+    def cached_style(self, chat_id: int, default: str) -> str:
+        """Get a chat's latest loaded style without touching the database"""
+        profile = self.profiles.get(chat_id)
+        return profile["style"] if profile else default
+
+    def note_message(self, db, chat_id: int):
+        """Count a new message, refreshing the profile in the background once one is due
+
+        A refresh is due after STYLE_REFRESH_MESSAGES new messages, or after
+        STYLE_REFRESH_MIN_MESSAGES once the profile is STYLE_REFRESH_INTERVAL seconds old.
+        """
+        count = self.new_messages.get(chat_id, 0) + 1
+        self.new_messages[chat_id] = count
+
+        profile = self.profiles.get(chat_id)
+        if not profile or chat_id in self._refreshing:
+            return
+
+        age = (datetime.utcnow() - profile["updated_at"]).total_seconds()
+        if count >= STYLE_REFRESH_MESSAGES or (count >= STYLE_REFRESH_MIN_MESSAGES and age >= STYLE_REFRESH_INTERVAL):
+            # Reset now so messages arriving during the refresh don't schedule another one
+            self.new_messages[chat_id] = 0
+            asyncio.create_task(self._refresh_in_background(db, chat_id))
+
+    async def _refresh_in_background(self, db, chat_id: int):
+        try:
+            await self.refresh(db, chat_id, STYLE_REFRESH_MIN_MESSAGES)
+        except Exception as e:
+            print(f"Error refreshing style of chat {chat_id}: {e}")
@@ -1,38 +1,104 @@
 import asyncio
+import csv
+import gzip
+import heapq
+import io
+import json
 import os
-import re
+import time
+from collections import deque
 from datetime import datetime, timedelta
 from typing import List, Dict, Optional
-from pyrogram import Client
+from pyrogram import Client, filters, raw, utils
 from pyrogram.types import Message
-from pyrogram.errors import ChannelPrivate, ChatAdminRequired, UsernameNotOccupied
+from pyrogram.errors import ChannelPrivate, ChatAdminRequired, UsernameNotOccupied, FloodWait, PeerIdInvalid
+from pyrogram.handlers import MessageHandler, RawUpdateHandler
+from pyrogram.raw.types import UpdateChannel
 import aiofiles
-from config import API_ID, API_HASH, DOWNLOADS_PATH
+from config import (
+    API_ID, API_HASH, DOWNLOADS_PATH,
+    SCANNER_CONCURRENCY, SCANNER_FLOOD_RETRIES, SCANNER_MAX_FLOOD_WAIT, SCANNER_FLOOD_WINDOW,
+    MESSAGE_INDEX_ENABLED, SCANNER_SERVER_SEARCH,
+    SCANNER_GLOBAL_SEARCH, SCANNER_GLOBAL_SEARCH_LIMIT, SCANNER_GLOBAL_SEARCH_TYPES,
+    DIALOG_CACHE_TTL, SCAN_CHECKPOINTS_ENABLED,
+    EXPORT_FORMAT, EXPORT_GZIP_THRESHOLD
+)
+from services.message_index import MessageIndex
+from services.scan_checkpoints import ScanCheckpoints
+from utils.helpers import is_literal_term, TermMatcher
+
+EXPORT_FORMATS = ("txt", "jsonl", "csv")
+EXPORT_CSV_FIELDS = [
+    "date", "chat_id", "message_id", "user_id", "username", "first_name",
+    "matched_term", "text", "message_link"
+]
 
 class TelegramScanner:
-    def __init__(self, session_name: str = "scanner_session"):
+    def __init__(self, session_name: str = "scanner_session", concurrency: int = SCANNER_CONCURRENCY):
         self.client = Client(
             session_name,
             api_id=API_ID,
             api_hash=API_HASH
         )
         self.is_connected = False
+        
+        # Bounds the number of chats fetched in parallel on this session
+        self.concurrency = max(1, concurrency)
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._pending = 0  # Chat scans running on or waiting for this session
+        
+        # Recent FloodWaits, so a session pool can balance load away from limited accounts
+        self.flood_until = 0.0
+        self._flood_history = deque()
+        
+        # Local full-text index; searches only fetch messages newer than what is indexed
+        self.index = MessageIndex() if MESSAGE_INDEX_ENABLED else None
+        
+        # username (lowercase) -> user id, resolved once per session
+        self._user_ids = {}
+        # User ids this session's account can address, since peers are per account
+        self._known_users = set()
+        
+        # Per-chat progress of global searches, so retries resume instead of refetching
+        self.checkpoints = ScanCheckpoints() if SCAN_CHECKPOINTS_ENABLED else None
+        
+        # Dialog list cache shared by every search command
+        self._dialogs = None
+        self._dialogs_fetched_at = 0.0
+        self._dialogs_lock = asyncio.Lock()
+        self._refresh_task = None
+        self.pool = None  # Pool whose merged dialog list includes this session's dialogs
+        
+        # Joining or leaving a chat makes the cached dialog list stale
+        self.client.add_handler(RawUpdateHandler(self._on_raw_update))
+        self.client.add_handler(MessageHandler(
+            self._on_membership_change,
+            filters.new_chat_members | filters.left_chat_member
+        ))
 
     async def connect(self):
         """Connect to Telegram"""
         if not self.is_connected:
             await self.client.start()
             self.is_connected = True
+            if DIALOG_CACHE_TTL > 0:
+                self._refresh_task = asyncio.create_task(self._refresh_dialogs_periodically())
 
     async def disconnect(self):
         """Disconnect from Telegram"""
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            self._refresh_task = None
         if self.is_connected:
             await self.client.stop()
             self.is_connected = False
+        if self.index:
+            await self.index.close()
+        if self.checkpoints:
+            await self.checkpoints.close()
 
-    async def get_dialogs(self) -> List[Dict]:
-        """Get all available chats/channels/groups"""
-        await self.connect()
+    async def _fetch_dialogs(self) -> List[Dict]:
+        """Enumerate all dialogs from Telegram"""
         dialogs = []
         
         async for dialog in self.client.get_dialogs():
@@ -47,40 +113,278 @@ class TelegramScanner:
         
         return dialogs
 
-    async def search_in_chat(self, chat_id: int, search_terms: List[str], limit: int = 1000) -> List[Dict]:
-        """Search for messages containing specific terms in a chat"""
+    def _dialogs_fresh(self) -> bool:
+        return self._dialogs is not None and time.monotonic() - self._dialogs_fetched_at < DIALOG_CACHE_TTL
+
+    async def get_dialogs(self, force_refresh: bool = False) -> List[Dict]:
+        """Get all available chats/channels/groups, served from cache while fresh"""
         await self.connect()
-        results = []
         
-        try:
-            # Compile regex patterns for each search term
-            patterns = [re.compile(term, re.IGNORECASE) for term in search_terms]
+        if force_refresh or not self._dialogs_fresh():
+            async with self._dialogs_lock:
+                # Another caller may have refreshed while we waited for the lock
+                if force_refresh or not self._dialogs_fresh():
+                    self._dialogs = await self._fetch_dialogs()
+                    self._dialogs_fetched_at = time.monotonic()
+        
+        return list(self._dialogs)
+
+    def invalidate_dialogs(self):
+        """Mark the cached dialog list stale so the next caller refetches it"""
+        self._dialogs_fetched_at = 0.0
+        if self.pool:
+            self.pool.invalidate_dialogs()
+
+    async def _refresh_dialogs_periodically(self):
+        """Refresh the dialog cache shortly before it expires so commands rarely wait on it"""
+        while True:
+            await asyncio.sleep(DIALOG_CACHE_TTL * 0.8)
+            try:
+                await self.get_dialogs(force_refresh=True)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error refreshing dialogs: {e}")
+
+    async def _on_raw_update(self, client: Client, update, users, chats):
+        """Telegram sends UpdateChannel when the account joins, leaves or is removed from a channel"""
+        if isinstance(update, UpdateChannel):
+            self.invalidate_dialogs()
+
+    async def _on_membership_change(self, client: Client, message: Message):
+        """Catch the account being added to or removed from basic groups"""
+        members = list(message.new_chat_members or [])
+        if message.left_chat_member:
+            members.append(message.left_chat_member)
+        if any(member.is_self for member in members):
+            self.invalidate_dialogs()
+
+    def _message_record(self, message: Message) -> Dict:
+        """Flatten a Pyrogram message into the fields search results need"""
+        return {
+            "message_id": message.id,
+            "user_id": message.from_user.id if message.from_user else None,
+            "username": message.from_user.username if message.from_user else None,
+            "first_name": message.from_user.first_name if message.from_user else None,
+            "text": message.text,
+            "date": message.date.isoformat()
+        }
+
+    def _build_result(self, chat_id: int, record: Dict, matched_term: str) -> Dict:
+        """Build a search result from a message record"""
+        return {
+            "message_id": record["message_id"],
+            "chat_id": chat_id,
+            "user_id": record["user_id"],
+            "username": record["username"],
+            "first_name": record["first_name"],
+            "text": record["text"],
+            "date": record["date"],
+            "matched_term": matched_term,
+            "message_link": f"https://t.me/c/{str(chat_id)[4:]}/{record['message_id']}" if chat_id < 0 else None
+        }
+
+    async def _sync_chat(self, chat_id: int, limit: int):
+        """Pull messages the local index is missing for a chat
+
+        Only messages newer than the high-water mark are fetched, plus older history
+        when an earlier sync walked fewer than `limit` messages. If more than `limit`
+        messages arrived since the last sync, the ones in between are recorded as a gap
+        and backfilled by this and later syncs.
+        """
+        state = await self.index.get_sync_state(chat_id)
+        high_water = state["high_water"] if state else 0
+        fresh = []
+        walked = 0
+        newest = high_water
+        oldest = None
+        caught_up = False
+        
+        # History is returned newest first, so stop at the first already-indexed message
+        async for message in self.client.get_chat_history(chat_id, limit=limit):
+            if message.id <= high_water:
+                caught_up = True
+                break
+            walked += 1
+            newest = max(newest, message.id)
+            oldest = message.id
+            if message.text:
+                fresh.append(self._message_record(message))
+        
+        if state is None:
+            # First sync: everything walked is contiguous from the newest message
+            state = {
+                "high_water": newest,
+                "low_water": oldest if walked >= limit else 0,
+                "covered": walked,
+                "gaps": []
+            }
+        else:
+            gaps = list(state["gaps"])
+            if not caught_up and walked >= limit:
+                gaps.insert(0, {"lower": high_water, "upper": oldest})
+            state = dict(state, high_water=newest, covered=state["covered"] + walked)
+            state["gaps"] = await self._backfill_gaps(
+                gaps, limit, fresh,
+                lambda gap, limit: self.client.get_chat_history(chat_id, limit=limit, offset_id=gap["upper"])
+            )
             
-            message_count = 0
-            async for message in self.client.get_chat_history(chat_id, limit=limit):
-                if message_count >= limit:
+            # Backfill older history if a previous sync walked less than this search wants
+            wanted = limit - state["covered"]
+            if wanted > 0 and state["low_water"] > 0:
+                backfilled = 0
+                async for message in self.client.get_chat_history(
+                    chat_id, limit=wanted, offset_id=state["low_water"]
+                ):
+                    backfilled += 1
+                    state["low_water"] = message.id
+                    if message.text:
+                        fresh.append(self._message_record(message))
+                state["covered"] += backfilled
+                if backfilled < wanted:
+                    state["low_water"] = 0
+        
+        await self.index.add_messages(chat_id, fresh, state)
+
+    async def _backfill_gaps(self, gaps: List[Dict], limit: int, fresh: List[Dict], fetch) -> List[Dict]:
+        """Fetch up to `limit` messages from gaps, newest gap first, returning the gaps left
+
+        fetch(gap, limit) yields messages older than the gap's upper end, newest first.
+        """
+        remaining = []
+        for gap in gaps:
+            if limit <= 0:
+                remaining.append(gap)
+                continue
+            
+            walked = 0
+            closed = True
+            async for message in fetch(gap, limit):
+                if message.id <= gap["lower"]:
                     break
-                    
-                message_count += 1
-                
+                walked += 1
+                gap = dict(gap, upper=message.id)
                 if message.text:
-                    # Check if any search term matches
-                    for i, pattern in enumerate(patterns):
-                        if pattern.search(message.text):
-                            result = {
-                                "message_id": message.id,
-                                "chat_id": chat_id,
-                                "user_id": message.from_user.id if message.from_user else None,
-                                "username": message.from_user.username if message.from_user else None,
-                                "first_name": message.from_user.first_name if message.from_user else None,
-                                "text": message.text,
-                                "date": message.date.isoformat(),
-                                "matched_term": search_terms[i],
-                                "message_link": f"https://t.me/c/{str(chat_id)[4:]}/{message.id}" if chat_id < 0 else None
-                            }
-                            results.append(result)
-                            break  # Don't duplicate results for multiple matches in same message
+                    fresh.append(self._message_record(message))
+            else:
+                # Stopped by the limit rather than by reaching the gap's lower end
+                closed = walked < limit
+            
+            limit -= walked
+            if not closed:
+                remaining.append(gap)
+        return remaining
+
+    async def _iter_records(self, chat_id: int, search_terms: List[str], limit: int):
+        """Yield candidate message records for a chat, newest first"""
+        if self.index:
+            await self._sync_chat(chat_id, limit)
+            for record in await self.index.find_candidates(chat_id, search_terms, limit):
+                yield record
+            return
+        
+        async for message in self.client.get_chat_history(chat_id, limit=limit):
+            if message.text:
+                yield self._message_record(message)
+
+    def _is_from_user(self, record: Dict, from_user) -> bool:
+        """Check if a message record was sent by a user given as id or username"""
+        if isinstance(from_user, int):
+            return record["user_id"] == from_user
+        username = str(from_user).lstrip('@').lower()
+        return bool(record["username"]) and record["username"].lower() == username
+
+    async def _server_search(self, chat_id: int, search_terms: List[str], limit: int, from_user=None) -> Dict[int, Dict]:
+        """Run each term through Telegram's per-chat search and merge the hits by message id"""
+        records = {}
+        for term in search_terms:
+            async for message in self.client.search_messages(
+                chat_id, query=term, limit=limit, from_user=from_user
+            ):
+                if message.text and message.id not in records:
+                    records[message.id] = self._message_record(message)
+        return records
+
+    async def iter_chat_matches(
+        self,
+        chat_id: int,
+        search_terms: List[str],
+        limit: int = 1000,
+        from_user=None,
+        server_search: bool = None,
+        cutoff=None
+    ):
+        """Yield a chat's messages matching any term as search results, newest first
+
+        With server_search, plain-text terms are pushed to Telegram's own search, which
+        reaches past the last `limit` messages; only regex terms still read the history.
+        If cutoff is given it is called for the oldest date still worth reading, and the
+        chat stops being read at the first message older than that.
+        """
+        await self.connect()
+        
+        if server_search is None:
+            server_search = SCANNER_SERVER_SEARCH
+        
+        # One compiled matcher for all terms
+        matcher = TermMatcher(search_terms)
+        
+        server_terms = [term for term in search_terms if is_literal_term(term)] if server_search else []
+        history_terms = [term for term in search_terms if term not in server_terms]
+        
+        # Telegram search hits are few, so fetch them up front and merge them into the history
+        server_records = []
+        if server_terms:
+            hits = await self._server_search(chat_id, server_terms, limit, from_user)
+            server_records = [hits[message_id] for message_id in sorted(hits, reverse=True)]
+        
+        async def records():
+            position = 0
+            if history_terms:
+                async for record in self._iter_records(chat_id, history_terms, limit):
+                    if from_user is not None and not self._is_from_user(record, from_user):
+                        continue
+                    while position < len(server_records) and server_records[position]["message_id"] >= record["message_id"]:
+                        yield server_records[position]
+                        position += 1
+                    yield record
+            for record in server_records[position:]:
+                yield record
+        
+        seen = set()
+        async for record in records():
+            if record["message_id"] in seen:
+                continue
+            seen.add(record["message_id"])
+            
+            oldest_wanted = cutoff() if cutoff else None
+            if oldest_wanted and record["date"] < oldest_wanted:
+                break
+            
+            # Check if any search term matches; Telegram search hits are re-checked too
+            matched_term = matcher.match(record["text"])
+            if matched_term:
+                yield self._build_result(chat_id, record, matched_term)
+
+    async def search_in_chat(
+        self,
+        chat_id: int,
+        search_terms: List[str],
+        limit: int = 1000,
+        from_user=None,
+        server_search: bool = None
+    ) -> List[Dict]:
+        """Search for messages containing specific terms in a chat"""
+        await self.connect()
+        results = []
+        
+        try:
+            async for result in self.iter_chat_matches(chat_id, search_terms, limit, from_user, server_search):
+                results.append(result)
                             
+        except FloodWait:
+            # Let the fan-out engine park this chat and retry it
+            raise
         except ChannelPrivate:
             raise Exception(f"Chat {chat_id} is private or bot doesn't have access")
         except ChatAdminRequired:
@@ -90,138 +394,599 @@ class TelegramScanner:
         
         return results
 
-    async def search_across_all_chats(self, search_terms: List[str], max_results: int = 100) -> Dict:
-        """Search for terms across all accessible chats"""
+    async def resolve_user_id(self, username: str) -> Optional[int]:
+        """Resolve a username to a user id, falling back to ids seen in the local index"""
         await self.connect()
-        all_results = []
+        username = username.lstrip('@')
+        key = username.lower()
+        
+        if key not in self._user_ids:
+            user_id = None
+            try:
+                user = await self.client.get_users(username)
+                user_id = user.id
+            except FloodWait:
+                raise
+            except Exception:
+                # Changed or hidden usernames no longer resolve, but older messages remember them
+                if self.index:
+                    user_id = await self.index.find_user_id(username)
+            if user_id is None:
+                return None
+            self._user_ids[key] = user_id
+        
+        return self._user_ids[key]
+
+    async def can_address_user(self, user_id: int, username: str) -> bool:
+        """Check if this session's account can address a user id, resolving it if needed
+
+        Ids resolved by another session can't be used until this account has seen the
+        user itself, so an unknown id is looked up through the username.
+        """
+        await self.connect()
+        if user_id not in self._known_users:
+            try:
+                await self.client.get_users(user_id)
+            except FloodWait:
+                raise
+            except PeerIdInvalid:
+                try:
+                    user = await self.client.get_users(username.lstrip('@'))
+                except FloodWait:
+                    raise
+                except Exception:
+                    return False
+                if user.id != user_id:
+                    return False
+            except Exception:
+                return False
+            self._known_users.add(user_id)
+        return True
+
+    async def _search_user_range(self, chat_id: int, user_id: int, lower: int, upper: int, limit: int):
+        """Yield a user's messages in a chat with lower < id < upper, newest first
+
+        search_messages can only page by offset from the newest result, which shifts as
+        messages arrive, so this pages Telegram's search by message id instead.
+        """
+        peer = await self.client.resolve_peer(chat_id)
+        from_id = await self.client.resolve_peer(user_id)
+        offset_id = upper
+        while limit > 0:
+            found = await self.client.invoke(raw.functions.messages.Search(
+                peer=peer,
+                q="",
+                filter=raw.types.InputMessagesFilterEmpty(),
+                min_date=0,
+                max_date=0,
+                offset_id=offset_id,
+                add_offset=0,
+                limit=min(100, limit),
+                max_id=upper,
+                min_id=lower,
+                hash=0,
+                from_id=from_id
+            ))
+            messages = await utils.parse_messages(self.client, found)
+            if not messages:
+                return
+            for message in messages:
+                yield message
+            limit -= len(messages)
+            offset_id = messages[-1].id
+
+    async def _iter_user_records(self, chat_id: int, user_id: int, limit: int):
+        """Yield a user's text messages in a chat, newest first, using Telegram's sender filter"""
+        if not self.index:
+            async for message in self.client.search_messages(chat_id, limit=limit, from_user=user_id):
+                if message.text:
+                    yield self._message_record(message)
+            return
+        
+        # Only pull the user's messages newer than what earlier searches indexed
+        state = await self.index.get_user_sync_state(user_id, chat_id)
+        high_water = state["high_water"]
+        newest = high_water
+        oldest = None
+        walked = 0
+        caught_up = False
+        fresh = []
+        async for message in self.client.search_messages(chat_id, limit=limit, from_user=user_id):
+            if message.id <= high_water:
+                caught_up = True
+                break
+            walked += 1
+            newest = max(newest, message.id)
+            oldest = message.id
+            if message.text:
+                fresh.append(self._message_record(message))
+        
+        # More new messages than one sync walks: remember the skipped ones and backfill them
+        gaps = list(state["gaps"])
+        if high_water and not caught_up and walked >= limit:
+            gaps.insert(0, {"lower": high_water, "upper": oldest})
+        gaps = await self._backfill_gaps(
+            gaps, limit, fresh,
+            lambda gap, limit: self._search_user_range(chat_id, user_id, gap["lower"], gap["upper"], limit)
+        )
+        
+        if newest > high_water or gaps != state["gaps"]:
+            await self.index.add_user_messages(user_id, chat_id, fresh, newest, gaps)
+        
+        for record in await self.index.find_user_messages(user_id, chat_id):
+            yield record
+
+    async def iter_user_matches(
+        self,
+        chat_id: int,
+        user_id: int,
+        search_terms: List[str],
+        limit: int = 500,
+        cutoff=None
+    ):
+        """Yield a user's messages in a chat matching any term as search results, newest first"""
+        await self.connect()
+        matcher = TermMatcher(search_terms)
+        
+        async for record in self._iter_user_records(chat_id, user_id, limit):
+            oldest_wanted = cutoff() if cutoff else None
+            if oldest_wanted and record["date"] < oldest_wanted:
+                break
+            
+            matched_term = matcher.match(record["text"])
+            if matched_term:
+                yield self._build_result(chat_id, record, matched_term)
+
+    def record_flood_wait(self, seconds: int):
+        """Note a FloodWait on this session so scheduling can steer work away from it"""
+        now = time.monotonic()
+        self.flood_until = max(self.flood_until, now + seconds)
+        self._flood_history.append((now, seconds))
+
+    def flood_pressure(self) -> int:
+        """Seconds of FloodWait this session received within the last SCANNER_FLOOD_WINDOW"""
+        horizon = time.monotonic() - SCANNER_FLOOD_WINDOW
+        while self._flood_history and self._flood_history[0][0] < horizon:
+            self._flood_history.popleft()
+        return sum(seconds for _, seconds in self._flood_history)
+
+    def _sessions_for(self, dialog: Dict) -> List["TelegramScanner"]:
+        """Sessions that can read a dialog; a single scanner only has itself"""
+        return [self]
+
+    def _pick_session(self, dialog: Dict) -> "TelegramScanner":
+        """Pick the least loaded session that can read a dialog, avoiding any in FloodWait"""
+        sessions = self._sessions_for(dialog)
+        now = time.monotonic()
+        ready = [session for session in sessions if session.flood_until <= now] or sessions
+        return min(ready, key=lambda session: session._pending / session.concurrency + session.flood_pressure() / 60)
+
+    async def _scan_chat(self, dialog: Dict, scan) -> Dict:
+        """Run one chat's scan under its session's concurrency limit, parking only this chat on FloodWait"""
+        elapsed = 0.0
+        flood_waits = 0
+        
+        while True:
+            session = self._pick_session(dialog)
+            session._pending += 1
+            try:
+                async with session._semaphore:
+                    started = time.monotonic()
+                    try:
+                        found = await scan(dialog, session)
+                        elapsed += time.monotonic() - started
+                        return {"dialog": dialog, "found": found, "elapsed": elapsed,
+                                "flood_waits": flood_waits, "error": None}
+                    except FloodWait as e:
+                        elapsed += time.monotonic() - started
+                        wait = int(e.value)
+                        session.record_flood_wait(wait)
+                    except Exception as e:
+                        elapsed += time.monotonic() - started
+                        return {"dialog": dialog, "found": 0, "elapsed": elapsed,
+                                "flood_waits": flood_waits, "error": str(e)}
+            finally:
+                session._pending -= 1
+            
+            flood_waits += 1
+            if flood_waits > SCANNER_FLOOD_RETRIES or wait > SCANNER_MAX_FLOOD_WAIT:
+                return {"dialog": dialog, "found": 0, "elapsed": elapsed,
+                        "flood_waits": flood_waits, "error": f"FloodWait of {wait}s, giving up"}
+            
+            # Sleep outside the semaphore so other chats keep scanning meanwhile; if another
+            # session can read this chat and isn't flooded, retry there straight away
+            delay = min(session.flood_until for session in self._sessions_for(dialog)) - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    async def _fan_out(
+        self,
+        dialogs: List[Dict],
+        stream,
+        max_results: int,
+        initial: List[Dict] = None,
+        job_id: str = None
+    ) -> tuple:
+        """Scan dialogs concurrently and keep the newest max_results hits across all of them
+
+        stream(dialog, session, cutoff) yields one chat's results newest first. Every chat feeds
+        one bounded min-heap ordered by date, and a chat stops being read as soon as its
+        messages are older than the current K-th result, since nothing below can beat it.
+        With a job_id, each finished chat is checkpointed, and a rerun of a job that did not
+        finish reuses them; the checkpoints are dropped once every chat was tried.
+        """
+        max_results = max(1, max_results)
+        heap = []  # (date, chat_id, message_id, result), oldest kept result on top
+        seen = set()
         chat_summary = {}
+        chat_timings = {}
         
-        dialogs = await self.get_dialogs()
+        def offer(result: Dict) -> bool:
+            """Add a result to the top-K; False if it is too old to make it"""
+            entry = (result["date"], result["chat_id"], result["message_id"], result)
+            if len(heap) < max_results:
+                heapq.heappush(heap, entry)
+            elif entry[:3] > heap[0][:3]:
+                heapq.heapreplace(heap, entry)
+            else:
+                return False
+            return True
+        
+        def cutoff() -> Optional[str]:
+            return heap[0][0] if len(heap) >= max_results else None
+        
+        for result in initial or []:
+            seen.add((result["chat_id"], result["message_id"]))
+            offer(result)
+        # Hits already counted by the caller, so per-chat counts only include the chat's own
+        initial_keys = set(seen)
         
+        # Chats finished by an interrupted earlier run of the same job are not fetched again
+        checkpoints = self.checkpoints if job_id else None
+        resumed = await checkpoints.load(job_id, max_results) if checkpoints else {}
+        outcomes = []
         for dialog in dialogs:
-            try:
-                chat_results = await self.search_in_chat(
-                    dialog["id"], 
-                    search_terms, 
-                    limit=200  # Limit per chat to avoid overwhelming
-                )
-                
-                if chat_results:
-                    chat_summary[dialog["title"]] = {
-                        "chat_id": dialog["id"],
-                        "chat_type": dialog["type"],
-                        "results_count": len(chat_results),
-                        "username": dialog["username"]
-                    }
-                    all_results.extend(chat_results)
-                    
-                    # Break if we have enough results
-                    if len(all_results) >= max_results:
-                        break
-                        
-            except Exception as e:
+            if dialog["id"] not in resumed:
+                continue
+            found = 0
+            for result in resumed[dialog["id"]]:
+                key = (result["chat_id"], result["message_id"])
+                if key not in initial_keys:
+                    found += 1
+                if key not in seen:
+                    seen.add(key)
+                    offer(result)
+            outcomes.append({"dialog": dialog, "found": found, "elapsed": 0.0,
+                             "flood_waits": 0, "error": None, "resumed": True})
+        
+        async def scan(dialog: Dict, session: "TelegramScanner") -> int:
+            # Each attempt collects the chat's complete hit list; seen only dedupes the heap,
+            # which may already hold hits from the global search or a FloodWait-cut attempt
+            chat_results = []
+            async for result in stream(dialog, session, cutoff):
+                chat_results.append(result)
+                key = (result["chat_id"], result["message_id"])
+                if key in seen:
+                    continue
+                seen.add(key)
+                if not offer(result):
+                    break
+            
+            if checkpoints:
+                # With the heap full the chat may have been cut short by the threshold
+                await checkpoints.save(job_id, dialog["id"], chat_results, cutoff() is None, max_results)
+            return sum(
+                1 for result in chat_results
+                if (result["chat_id"], result["message_id"]) not in initial_keys
+            )
+        
+        # Dialogs come most recently active first, so the heap fills with new hits early
+        outcomes += await asyncio.gather(*(
+            self._scan_chat(dialog, scan) for dialog in dialogs if dialog["id"] not in resumed
+        ))
+        
+        # Every chat was tried, even if some failed: a finished job is not resumed, so
+        # repeating the search picks up new messages; only an interrupted run resumes
+        if checkpoints:
+            await checkpoints.clear(job_id)
+        
+        for outcome in outcomes:
+            dialog = outcome["dialog"]
+            chat_timings[dialog["id"]] = {
+                "title": dialog["title"],
+                "elapsed": round(outcome["elapsed"], 3),
+                "flood_waits": outcome["flood_waits"],
+                "results_count": outcome["found"],
+                "resumed": outcome.get("resumed", False)
+            }
+            
+            if outcome["error"]:
                 # Log error but continue with other chats
-                print(f"Error searching in {dialog['title']}: {str(e)}")
+                print(f"Error searching in {dialog['title']}: {outcome['error']}")
                 continue
+            
+            if outcome["found"]:
+                chat_summary[dialog["title"]] = {
+                    "chat_id": dialog["id"],
+                    "chat_type": dialog["type"],
+                    "results_count": outcome["found"],
+                    "username": dialog["username"]
+                }
         
-        # Sort results by date (newest first)
-        all_results.sort(key=lambda x: x["date"], reverse=True)
+        results = [entry[3] for entry in sorted(heap, key=lambda entry: entry[:3], reverse=True)]
+        return results, len(seen), chat_summary, chat_timings
+
+    async def _global_search(self, search_terms: List[str], limit: int) -> Dict[tuple, Dict]:
+        """Run each term through Telegram's global search, keyed by (chat_id, message_id)"""
+        hits = {}
+        
+        for term in search_terms:
+            flood_waits = 0
+            while True:
+                try:
+                    # search_global pages through results by offset until limit is reached
+                    async for message in self.client.search_global(query=term, limit=limit):
+                        if message.text and message.chat:
+                            hits.setdefault((message.chat.id, message.id), {
+                                "chat": message.chat,
+                                "record": self._message_record(message)
+                            })
+                    break
+                except FloodWait as e:
+                    # Already collected hits are kept, so a retry only costs the pages refetched
+                    self.record_flood_wait(int(e.value))
+                    flood_waits += 1
+                    if flood_waits > SCANNER_FLOOD_RETRIES or int(e.value) > SCANNER_MAX_FLOOD_WAIT:
+                        print(f"Global search for {term!r} gave up after FloodWait of {e.value}s")
+                        break
+                    await asyncio.sleep(int(e.value))
+        
+        return hits
+
+    async def search_across_all_chats(
+        self,
+        search_terms: List[str],
+        max_results: int = 100,
+        global_search: bool = None
+    ) -> Dict:
+        """Search for terms across all accessible chats
+
+        With global_search, plain-text terms are answered by one global Telegram query
+        per term; dialogs are only scanned for regex terms or chat types it doesn't cover.
+        """
+        await self.connect()
+        started = time.monotonic()
+        
+        if global_search is None:
+            global_search = SCANNER_GLOBAL_SEARCH
+        
+        dialogs = await self.get_dialogs()
+        
+        global_terms = [term for term in search_terms if is_literal_term(term)] if global_search else []
+        scan_terms = [term for term in search_terms if term not in global_terms]
+        
+        global_results = []
+        chat_summary = {}
+        
+        if global_terms:
+            matcher = TermMatcher(search_terms)
+            dialogs_by_id = {dialog["id"]: dialog for dialog in dialogs}
+            hits = await self._global_search(global_terms, SCANNER_GLOBAL_SEARCH_LIMIT)
+            
+            for (chat_id, _), hit in hits.items():
+                dialog = dialogs_by_id.get(chat_id)
+                chat = hit["chat"]
+                if dialog and dialog["type"] not in SCANNER_GLOBAL_SEARCH_TYPES:
+                    continue  # Scanned per dialog below, so don't count it twice
+                
+                matched_term = matcher.match(hit["record"]["text"])
+                if not matched_term:
+                    continue
+                global_results.append(self._build_result(chat_id, hit["record"], matched_term))
+                
+                title = dialog["title"] if dialog else (chat.title or chat.first_name or "Unknown")
+                if title not in chat_summary:
+                    chat_summary[title] = {
+                        "chat_id": chat_id,
+                        "chat_type": dialog["type"] if dialog else chat.type.value,
+                        "results_count": 0,
+                        "username": chat.username
+                    }
+                chat_summary[title]["results_count"] += 1
+        
+        def terms_for(dialog: Dict) -> List[str]:
+            # Global search runs on the primary session, so it misses chats only other sessions can read
+            if global_terms and (
+                dialog["type"] not in SCANNER_GLOBAL_SEARCH_TYPES or self not in self._sessions_for(dialog)
+            ):
+                return search_terms
+            return scan_terms
+        
+        def stream(dialog: Dict, session: "TelegramScanner", cutoff):
+            # Limit per chat to avoid overwhelming
+            return session.iter_chat_matches(dialog["id"], terms_for(dialog), limit=200, cutoff=cutoff)
+        
+        scan_dialogs = [dialog for dialog in dialogs if terms_for(dialog)]
+        job_id = ScanCheckpoints.job_id("searchall", search_terms, "global" if global_terms else None)
+        results, total_found, scanned_summary, chat_timings = await self._fan_out(
+            scan_dialogs, stream, max_results, initial=global_results, job_id=job_id
+        )
+        
+        for title, info in scanned_summary.items():
+            if title in chat_summary:
+                chat_summary[title]["results_count"] += info["results_count"]
+            else:
+                chat_summary[title] = info
         
         return {
-            "results": all_results[:max_results],
-            "total_found": len(all_results),
+            "results": results,
+            "total_found": total_found,
             "searched_chats": len(dialogs),
-            "chat_summary": chat_summary
+            "chat_summary": chat_summary,
+            "chat_timings": chat_timings,
+            "resumed_chats": sum(1 for timing in chat_timings.values() if timing["resumed"]),
+            "scan_time": round(time.monotonic() - started, 3)
         }
 
     async def search_user_in_chats(self, username: str, search_terms: List[str], max_results: int = 100) -> Dict:
         """Search for specific user's messages containing search terms"""
         await self.connect()
-        all_results = []
-        chat_summary = {}
+        started = time.monotonic()
         
         # Remove @ if present
         username = username.lstrip('@')
         
         dialogs = await self.get_dialogs()
         
-        for dialog in dialogs:
-            try:
-                chat_results = await self.search_in_chat(dialog["id"], search_terms, limit=500)
-                
-                # Filter results by username
-                user_results = [
-                    result for result in chat_results 
-                    if result["username"] and result["username"].lower() == username.lower()
-                ]
-                
-                if user_results:
-                    chat_summary[dialog["title"]] = {
-                        "chat_id": dialog["id"],
-                        "chat_type": dialog["type"],
-                        "results_count": len(user_results),
-                        "username": dialog["username"]
-                    }
-                    all_results.extend(user_results)
-                    
-                    if len(all_results) >= max_results:
-                        break
-                        
-            except Exception as e:
-                continue
+        # Matching on the user id also finds messages sent under an older username
+        user_id = await self.resolve_user_id(username)
         
-        all_results.sort(key=lambda x: x["date"], reverse=True)
+        async def stream(dialog: Dict, session: "TelegramScanner", cutoff):
+            shard_user_id = user_id
+            if user_id is not None and session is not self and not await session.can_address_user(user_id, username):
+                # The id was resolved on the primary: read the shard there if it can, else match by username
+                if self in self._sessions_for(dialog):
+                    session = self
+                else:
+                    shard_user_id = None
+            
+            if shard_user_id is not None:
+                records = session.iter_user_matches(dialog["id"], shard_user_id, search_terms, limit=500, cutoff=cutoff)
+            else:
+                records = session.iter_chat_matches(
+                    dialog["id"], search_terms, limit=500, from_user=username, cutoff=cutoff
+                )
+            async for record in records:
+                yield record
+        
+        job_id = ScanCheckpoints.job_id("usaid", search_terms, str(user_id or username))
+        results, total_found, chat_summary, chat_timings = await self._fan_out(
+            dialogs, stream, max_results, job_id=job_id
+        )
         
         return {
-            "results": all_results[:max_results],
-            "total_found": len(all_results),
+            "results": results,
+            "total_found": total_found,
             "searched_chats": len(dialogs),
             "chat_summary": chat_summary,
-            "target_username": username
+            "chat_timings": chat_timings,
+            "resumed_chats": sum(1 for timing in chat_timings.values() if timing["resumed"]),
+            "scan_time": round(time.monotonic() - started, 3),
+            "target_username": username,
+            "target_user_id": user_id
         }
 
-    async def export_results_to_file(self, results: Dict, filename: str = None) -> str:
-        """Export search results to a text file"""
+    def _render_txt(self, results: Dict) -> str:
+        """Render search results as the human-readable text report"""
+        parts = ["TELEGRAM SEARCH RESULTS\n", "=" * 50 + "\n\n"]
+        
+        if "target_username" in results:
+            parts.append(f"Searched for user: @{results['target_username']}\n")
+        
+        parts.append(f"Search completed: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+        parts.append(f"Total results found: {results['total_found']}\n")
+        parts.append(f"Chats searched: {results['searched_chats']}\n")
+        if results.get('scan_time') is not None:
+            parts.append(f"Scan time: {results['scan_time']:.1f}s\n")
+        parts.append("\n")
+        
+        # Chat summary
+        if results['chat_summary']:
+            parts.append("CHAT SUMMARY:\n")
+            parts.append("-" * 30 + "\n")
+            for chat_title, info in results['chat_summary'].items():
+                parts.append(f"📁 {chat_title}: {info['results_count']} results\n")
+            parts.append("\n")
+        
+        # Per-chat timing, slowest first
+        if results.get('chat_timings'):
+            parts.append("SCAN TIMING:\n")
+            parts.append("-" * 30 + "\n")
+            timings = sorted(results['chat_timings'].values(), key=lambda t: t['elapsed'], reverse=True)
+            for timing in timings:
+                flood_note = f", {timing['flood_waits']} FloodWait" if timing['flood_waits'] else ""
+                resumed_note = " (resumed from checkpoint)" if timing.get('resumed') else ""
+                parts.append(f"⏱ {timing['title']}: {timing['elapsed']:.2f}s{flood_note}{resumed_note}\n")
+            parts.append("\n")
+        
+        # Detailed results
+        parts.append("DETAILED RESULTS:\n")
+        parts.append("-" * 30 + "\n")
+        
+        for i, result in enumerate(results['results'], 1):
+            parts.append(f"\n{i}. Message ID: {result['message_id']}\n")
+            parts.append(f"   Date: {result['date']}\n")
+            parts.append(f"   User: {result['first_name'] or 'Unknown'}")
+            if result['username']:
+                parts.append(f" (@{result['username']})")
+            parts.append(f"\n   Matched term: {result['matched_term']}\n")
+            parts.append(f"   Text: {result['text'][:500]}{'...' if len(result['text']) > 500 else ''}\n")
+            if result['message_link']:
+                parts.append(f"   Link: {result['message_link']}\n")
+            parts.append("-" * 50 + "\n")
+        
+        return "".join(parts)
+
+    def _render_jsonl(self, results: Dict) -> str:
+        """Render search results as one JSON object per line"""
+        return "".join(json.dumps(result, ensure_ascii=False) + "\n" for result in results['results'])
+
+    def _render_csv(self, results: Dict) -> str:
+        """Render search results as CSV with one row per message"""
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_CSV_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(results['results'])
+        return buffer.getvalue()
+
+    async def export_results(
+        self,
+        results: Dict,
+        filename: str = None,
+        fmt: str = EXPORT_FORMAT,
+        compress: bool = None
+    ) -> io.BytesIO:
+        """Render search results into an in-memory document that reply_document can upload
+
+        fmt is one of txt, jsonl or csv. With compress left as None, output larger than
+        EXPORT_GZIP_THRESHOLD bytes is gzipped.
+        """
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unsupported export format: {fmt}")
+        
         if not filename:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             filename = f"search_results_{timestamp}.txt"
+        filename = f"{os.path.splitext(filename)[0]}.{fmt}"
         
-        filepath = os.path.join(DOWNLOADS_PATH, filename)
+        renderer = {"txt": self._render_txt, "jsonl": self._render_jsonl, "csv": self._render_csv}[fmt]
         
-        async with aiofiles.open(filepath, 'w', encoding='utf-8') as f:
-            await f.write("TELEGRAM SEARCH RESULTS\n")
-            await f.write("=" * 50 + "\n\n")
-            
-            if "target_username" in results:
-                await f.write(f"Searched for user: @{results['target_username']}\n")
-            
-            await f.write(f"Search completed: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-            await f.write(f"Total results found: {results['total_found']}\n")
-            await f.write(f"Chats searched: {results['searched_chats']}\n\n")
-            
-            # Chat summary
-            if results['chat_summary']:
-                await f.write("CHAT SUMMARY:\n")
-                await f.write("-" * 30 + "\n")
-                for chat_title, info in results['chat_summary'].items():
-                    await f.write(f"📁 {chat_title}: {info['results_count']} results\n")
-                await f.write("\n")
-            
-            # Detailed results
-            await f.write("DETAILED RESULTS:\n")
-            await f.write("-" * 30 + "\n")
-            
-            for i, result in enumerate(results['results'], 1):
-                await f.write(f"\n{i}. Message ID: {result['message_id']}\n")
-                await f.write(f"   Date: {result['date']}\n")
-                await f.write(f"   User: {result['first_name'] or 'Unknown'}")
-                if result['username']:
-                    await f.write(f" (@{result['username']})")
-                await f.write(f"\n   Matched term: {result['matched_term']}\n")
-                await f.write(f"   Text: {result['text'][:500]}{'...' if len(result['text']) > 500 else ''}\n")
-                if result['message_link']:
-                    await f.write(f"   Link: {result['message_link']}\n")
-                await f.write("-" * 50 + "\n")
+        def render() -> tuple:
+            data = renderer(results).encode("utf-8")
+            if compress or (compress is None and len(data) > EXPORT_GZIP_THRESHOLD):
+                return gzip.compress(data), True
+            return data, False
+        
+        # Rendering and compressing thousands of results is CPU work, keep it off the event loop
+        data, compressed = await asyncio.to_thread(render)
+        
+        document = io.BytesIO(data)
+        document.name = filename + ".gz" if compressed else filename
+        return document
+
+    async def export_results_to_file(
+        self,
+        results: Dict,
+        filename: str = None,
+        fmt: str = EXPORT_FORMAT,
+        compress: bool = None
+    ) -> str:
+        """Export search results to a file in DOWNLOADS_PATH with a single write"""
+        document = await self.export_results(results, filename, fmt, compress)
+        filepath = os.path.join(DOWNLOADS_PATH, document.name)
+        
+        async with aiofiles.open(filepath, 'wb') as f:
+            await f.write(document.getvalue())
         
         return filepath
 
@@ -0,0 +1,57 @@
+import unittest
+from database.database import Database
+
+class FakeUsers:
+    """Stand-in for the users collection, recording the upserts it receives"""
+    def __init__(self):
+        self.documents = {}
+        self.upserts = 0
+
+    async def find_one_and_update(self, query, update, upsert=False, return_document=None):
+        self.upserts += 1
+        document = self.documents.setdefault(query["user_id"], {"user_id": query["user_id"], **update["$setOnInsert"]})
+        document.update(update["$set"])
+        return dict(document)
+
+    async def find_one(self, query):
+        document = self.documents.get(query["user_id"])
+        return dict(document) if document else None
+
+class FakeDb:
+    def __init__(self):
+        self.users = FakeUsers()
+
+class AddUserCacheTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.database = Database()
+        self.database.db = FakeDb()
+
+    async def test_cache_miss_registers_user(self):
+        await self.database.add_user(1, "alice", "Alice")
+
+        self.assertEqual(self.database.db.users.upserts, 1)
+        self.assertEqual((await self.database.get_user(1))["username"], "alice")
+
+    async def test_user_cached_as_unknown_is_registered(self):
+        self.assertIsNone(await self.database.get_user(1))
+
+        await self.database.add_user(1, "alice", "Alice")
+
+        self.assertEqual(self.database.db.users.upserts, 1)
+        self.assertTrue(await self.database.is_user_exists(1))
+
+    async def test_unchanged_cached_user_skips_upsert(self):
+        await self.database.add_user(1, "alice", "Alice")
+        await self.database.add_user(1, "alice", "Alice")
+
+        self.assertEqual(self.database.db.users.upserts, 1)
+
+    async def test_changed_cached_user_is_updated(self):
+        await self.database.add_user(1, "alice", "Alice")
+        await self.database.add_user(1, "alice2", "Alice")
+
+        self.assertEqual(self.database.db.users.upserts, 2)
+        self.assertEqual((await self.database.get_user(1))["username"], "alice2")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,24 +1,125 @@
 import asyncio
+import io
 import os
-from typing import Dict, List
+import re
+import time
+import uuid
+from collections import deque
+from typing import AsyncIterator, Dict, List, Optional, Union
 from datetime import datetime, timedelta
-from config import RATE_LIMIT_REQUESTS, RATE_LIMIT_WINDOW, ADMINS, MAX_RESULTS_NON_ADMIN
+import aiofiles
+import aiofiles.os
+from pyrogram.errors import FloodWait
+from database.periodic_flusher import PeriodicFlusher
+from config import (
+    RATE_LIMIT_REQUESTS, RATE_LIMIT_WINDOW, RATE_LIMIT_FLUSH_INTERVAL, ADMINS, MAX_RESULTS_NON_ADMIN,
+    DOWNLOADS_PATH, DOCUMENT_SPOOL_THRESHOLD, STREAM_EDIT_INTERVAL
+)
 
 async def is_admin(user_id: int) -> bool:
     """Check if user is an admin"""
     return user_id in ADMINS
 
+class RateLimiter(PeriodicFlusher):
+    """Sliding-window rate limiter kept in memory and written behind to MongoDB
+
+    Admission is decided from memory only; consumed requests are queued and written to
+    the rate_limits collection every RATE_LIMIT_FLUSH_INTERVAL seconds, and the window
+    is reloaded from there on startup so limits survive restarts.
+    """
+    flush_name = "rate limits"
+
+    def __init__(self, limit: int = RATE_LIMIT_REQUESTS, window: int = RATE_LIMIT_WINDOW):
+        super().__init__(RATE_LIMIT_FLUSH_INTERVAL)
+        self.limit = limit
+        self.window = timedelta(seconds=window)
+        self.requests = {}  # (user_id, command) -> deque of request timestamps, oldest first
+        self.pending = []  # requests not yet written to MongoDB
+        self.db = None
+    
+    def _recent(self, user_id: int, command: str, now: datetime) -> deque:
+        """Get a key's request timestamps with those outside the window dropped"""
+        key = (user_id, command)
+        timestamps = self.requests.setdefault(key, deque())
+        cutoff = now - self.window
+        while timestamps and timestamps[0] < cutoff:
+            timestamps.popleft()
+        return timestamps
+    
+    def allows(self, user_id: int, command: str) -> bool:
+        """Check if a request would be admitted, without consuming it"""
+        return len(self._recent(user_id, command, datetime.utcnow())) < self.limit
+    
+    def consume(self, user_id: int, command: str) -> bool:
+        """Admit and record a request if the user is under the limit
+        
+        Check and record happen without yielding to the event loop, so concurrent
+        requests can never both take the last slot.
+        """
+        now = datetime.utcnow()
+        timestamps = self._recent(user_id, command, now)
+        if len(timestamps) >= self.limit:
+            return False
+        
+        timestamps.append(now)
+        self.pending.append({"user_id": user_id, "command": command, "timestamp": now})
+        return True
+    
+    async def start(self, db):
+        """Reload the current window from MongoDB and start writing behind to it"""
+        self.db = db
+        try:
+            records = await db.get_recent_requests(int(self.window.total_seconds()))
+        except Exception as e:
+            print(f"Error loading rate limits: {e}")
+            records = []
+        
+        now = datetime.utcnow()
+        for record in sorted(records, key=lambda r: r["timestamp"]):
+            self._recent(record["user_id"], record["command"], now).append(record["timestamp"])
+        
+        self._start_flushing()
+    
+    def _take_pending(self) -> List[Dict]:
+        if not self.db:
+            return []
+        batch, self.pending = self.pending, []
+        return batch
+    
+    async def _write_pending(self, batch: List[Dict]):
+        await self.db.record_requests(batch)
+    
+    def _requeue(self, batch: List[Dict]):
+        self.pending = batch + self.pending
+    
+    async def flush(self):
+        """Write queued requests to MongoDB and drop keys whose window has emptied"""
+        await super().flush()
+        now = datetime.utcnow()
+        for key in list(self.requests):
+            if not self._recent(*key, now):
+                del self.requests[key]
+    
+    async def stop(self):
+        """Stop the background writer and flush what is left"""
+        await self._stop_flushing()
+
+# Global rate limiter instance
+rate_limiter = RateLimiter()
+
 async def check_rate_limit(db, user_id: int, command: str) -> bool:
     """Check if user has exceeded rate limit"""
     if await is_admin(user_id):
         return True  # Admins have no rate limits
     
-    return await db.check_rate_limit(user_id, command, RATE_LIMIT_REQUESTS, RATE_LIMIT_WINDOW)
+    return rate_limiter.allows(user_id, command)
 
-async def record_command_usage(db, user_id: int, command: str):
-    """Record command usage for rate limiting"""
-    if not await is_admin(user_id):
-        await db.record_request(user_id, command)
+async def record_command_usage(db, user_id: int, command: str) -> bool:
+    """Record command usage for rate limiting, returning False if the limit was reached meanwhile"""
+    if await is_admin(user_id):
+        return True
+    
+    return rate_limiter.consume(user_id, command)
 
 def format_file_size(size_bytes: int) -> str:
     """Format file size in human readable format"""
@@ -45,14 +146,52 @@ async def create_results_file(content: str, filename: str = None) -> str:
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         filename = f"results_{timestamp}.txt"
     
-    filepath = os.path.join("downloads", filename)
-    os.makedirs("downloads", exist_ok=True)
+    filepath = os.path.join(DOWNLOADS_PATH, filename)
     
-    with open(filepath, 'w', encoding='utf-8') as f:
-        f.write(content)
+    async with aiofiles.open(filepath, 'w', encoding='utf-8') as f:
+        await f.write(content)
     
     return filepath
 
+async def send_results_document(
+    message,
+    content: Union[str, bytes, io.BytesIO],
+    filename: str = None,
+    caption: str = None
+):
+    """Reply with results as a document, uploaded straight from memory
+
+    Content above DOCUMENT_SPOOL_THRESHOLD bytes is spooled to a uniquely named file in
+    DOWNLOADS_PATH with async I/O first, and removed once uploaded.
+    """
+    if isinstance(content, io.BytesIO):
+        filename = filename or getattr(content, 'name', None)
+        data = content.getvalue()
+    elif isinstance(content, str):
+        data = content.encode('utf-8')
+    else:
+        data = content
+    
+    filename = sanitize_filename(filename or f"results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt")
+    
+    if len(data) <= DOCUMENT_SPOOL_THRESHOLD:
+        document = io.BytesIO(data)
+        document.name = filename
+        return await message.reply_document(document, caption=caption)
+    
+    # Unique path so concurrent requests for the same query can't overwrite each other
+    filepath = os.path.join(DOWNLOADS_PATH, f"{uuid.uuid4().hex}_{filename}")
+    async with aiofiles.open(filepath, 'wb') as f:
+        await f.write(data)
+    
+    try:
+        return await message.reply_document(filepath, caption=caption, file_name=filename)
+    finally:
+        try:
+            await aiofiles.os.remove(filepath)
+        except OSError:
+            pass
+
 def get_max_results(user_id: int, user_specified: int = None) -> int:
     """Get maximum results based on user specification with 200 limit for all users"""
     if user_specified is not None:
@@ -68,6 +207,85 @@ def parse_search_terms(query: str) -> List[str]:
     """Parse comma-separated search terms"""
     return [term.strip() for term in query.split(',') if term.strip()]
 
+def is_literal_term(term: str) -> bool:
+    """Check if a search term has no regex metacharacters and can be matched as plain text"""
+    return not any(char in ".^$*+?{}[]\\|()" for char in term)
+
+def _trie_pattern(words: List[str]) -> str:
+    """Build a regex alternation for literal words that shares common prefixes"""
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+    
+    def build(node: Dict) -> str:
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        pattern = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if '' in node:
+            pattern = '(?:' + pattern + ')?'
+        return pattern
+    
+    return build(trie)
+
+class TermMatcher:
+    """Match text against many search terms in a single pass
+
+    Literal terms are compiled into one prefix-sharing alternation, so the work per
+    message does not grow with the number of terms; regex terms become one alternation
+    of named groups. The reported term is the one matching earliest in the text.
+    """
+    def __init__(self, search_terms: List[str]):
+        self.terms = list(search_terms)
+        # Compile each term on its own first so invalid patterns fail like they always did
+        self._patterns = [re.compile(term, re.IGNORECASE) for term in self.terms]
+        self._combined = None
+        self._lookup = {}
+        
+        lowered = [term.lower() for term in self.terms]
+        if all(is_literal_term(term) for term in self.terms) and all(
+            len(low) == len(term) for low, term in zip(lowered, self.terms)
+        ):
+            # First term wins when several lowercase to the same text
+            for low, term in zip(reversed(lowered), reversed(self.terms)):
+                self._lookup[low] = term
+            self._combined = re.compile(_trie_pattern(lowered), re.IGNORECASE)
+        elif not any(re.search(r'\\[1-9]|\(\?P=', term) for term in self.terms):
+            # Backreferences would point at the wrong group once terms are wrapped
+            try:
+                self._combined = re.compile(
+                    '|'.join(f'(?P<t{i}>{term})' for i, term in enumerate(self.terms)),
+                    re.IGNORECASE
+                )
+            except re.error:
+                self._combined = None
+
+    def match(self, text: str) -> Optional[str]:
+        """Return the search term matching the text, or None"""
+        if self._combined is None:
+            for term, pattern in zip(self.terms, self._patterns):
+                if pattern.search(text):
+                    return term
+            return None
+        
+        match = self._combined.search(text)
+        if not match:
+            return None
+        if match.lastgroup:
+            return self.terms[int(match.lastgroup[1:])]
+        
+        matched = match.group(0).lower()
+        if matched in self._lookup:
+            return self._lookup[matched]
+        # Case folding can differ from lower(); resolve the term the slow way
+        for term, pattern in zip(self.terms, self._patterns):
+            if pattern.fullmatch(match.group(0)):
+                return term
+        return self.terms[0]
+
 def parse_search_command(command_text: str) -> tuple:
     """Parse search command to extract terms and optional result count
     
@@ -189,6 +407,50 @@ async def send_long_message(client, chat_id: int, text: str, max_length: int = 4
             await asyncio.sleep(1)  # Small delay between messages
         await client.send_message(chat_id, chunk)
 
+async def stream_reply(
+    message,
+    chunks: AsyncIterator[str],
+    placeholder: str = "💭",
+    edit_interval: float = STREAM_EDIT_INTERVAL
+) -> str:
+    """Reply with a placeholder and edit it as text chunks arrive, returning the final text
+    
+    The first text is shown as soon as it arrives; after that, chunks arriving within
+    edit_interval seconds of the last edit are coalesced into the next one, and a
+    FloodWait on an intermediate edit just postpones it. The complete text
+    is always written by a final edit. The placeholder is deleted if nothing was produced.
+    """
+    reply = await message.reply_text(placeholder)
+    text = ""
+    shown = placeholder
+    next_edit_at = 0.0  # Only edits after the first are throttled
+    
+    async for chunk in chunks:
+        text += chunk
+        visible = truncate_text(text.strip())
+        if not visible or visible == shown or time.monotonic() < next_edit_at:
+            continue
+        
+        try:
+            await reply.edit_text(visible)
+            shown = visible
+            next_edit_at = time.monotonic() + edit_interval
+        except FloodWait as e:
+            next_edit_at = time.monotonic() + e.value
+    
+    text = text.strip()
+    if not text:
+        await reply.delete()
+        return ""
+    
+    if truncate_text(text) != shown:
+        try:
+            await reply.edit_text(truncate_text(text))
+        except FloodWait as e:
+            await asyncio.sleep(e.value)
+            await reply.edit_text(truncate_text(text))
+    return text
+
 class MessageTracker:
     """Track bot interactions in chats"""
     def __init__(self):